@@ -1,9 +1,10 @@
-import re
-import xlwt
-import sqlite3
-
 import action
+import config
 
+from crawler import Crawler
+from exporter import ExportThread
+from history_dialog import HistoryDialog
+from table_model import ProductTableModel
 from PyQt5 import QtCore, QtWidgets, QtGui
 from PyQt5.QtCore import QThread, pyqtSignal, QSettings, QSize
 from PyQt5.QtGui import QColor
@@ -11,60 +12,28 @@ from PyQt5.QtWidgets import QFileDialog, QProgressBar
 from pyqtspinner import WaitingSpinner
 
 class RequestThread(QThread):
-	request_completed = pyqtSignal(str)
+	status_changed = pyqtSignal(str)
+	progress_changed = pyqtSignal(dict)
+	error_occurred = pyqtSignal(str)
+	products_found = pyqtSignal(list)
 
-	def __init__(self, handler):
+	def __init__(self, handler, mode = 'ranking', resume = False):
 		super().__init__()
 		self.ui_handler = handler
-		self.total_count = 350000
+		self.crawler = Crawler(
+			handler,
+			mode,
+			resume,
+			should_stop = lambda: handler.main_window.isStop,
+			refresh_rate = getattr(config, 'UI_REFRESH_RATE', 10),
+			on_status = self.status_changed.emit,
+			on_progress = self.progress_changed.emit,
+			on_error = self.error_occurred.emit,
+			on_products = self.products_found.emit
+		)
 
 	def run(self):
-		self.request_completed.emit("start")
-
-			# result = self.ui_handler.product_list_download_from_amazon()
-			# print(type(result) == str)
-			# if(type(result) == str):
-			# 	self.request_completed.emit(result)
-			# 	self.request_completed.emit("stop")
-			
-			# print(result)
-			# total = result['total']
-			# document_id = result['filepath']
-
-			# self.request_completed.emit("reading")
-			# result = self.ui_handler.read_product_list_from_file(document_id)
-			# if(result != 'success'):
-			# 	self.request_completed.emit(result)
-			# 	self.request_completed.emit('stop')
-
-		cur_position = 0
-		while cur_position < self.total_count:
-			if not self.ui_handler.main_window.isStop:
-				try:
-					cur_position += 1
-					if(cur_position == 150000 or cur_position == 300000):
-						self.ui_handler.cur_page = 0
-
-					self.ui_handler.cur_page += 1
-					# product_list = self.ui_handler.get_product_info_by_product_list(cur_position)
-					product_list = self.ui_handler.get_products_list(cur_position)
-
-					# key_arr = [['4580128895130', '', '', '10000'], ['4580128895383', '', '', '10000'], ['4988067000125', '', '', '10000']]
-					for product in product_list:
-						cur_position += 1
-						if(product[0] != ''):
-							self.ui_handler.get_product_url(product, cur_position)
-
-						progress = 100 / self.total_count * cur_position
-						self.request_completed.emit(str(progress))
-				except Exception as e:
-					self.request_completed.emit(e)
-			else:
-				self.request_completed.emit("stop")
-				self.quit()
-				break
-
-		self.request_completed.emit("stop")
+		self.crawler.run()
 		self.quit()
 
 class Ui_MainWindow(object):
@@ -77,18 +46,24 @@ class Ui_MainWindow(object):
 		self.progressBar = None
 		self.statusLabel = None
 		self.tbl_dataview = None
+		self.product_model = None
 		self.btn_start = None
 		self.horizontalLayout = None
 		self.horizontalLayout_2 = None
 		self.horizontalLayout_3 = None
 		self.btn_export = None
 		self.btn_history = None
+		self.btn_resume = None
+		self.chk_export_matched = None
+		self.export_thread = None
 		self.gridLayout = None
 		self.centralwidget = None
 		self.verticalLayout = None
 		self.isStop = True
 		self.settings = None
 		self.cmb_export_type = None
+		self.cmb_discovery = None
+		self.cmb_source = None
 		self.request_thread = None
 		self.ui_handler = action.ActionManagement(self)
 
@@ -135,6 +110,23 @@ class Ui_MainWindow(object):
 		self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
 		self.horizontalLayout_2.setSpacing(12)
 		self.horizontalLayout_2.setObjectName("horizontalLayout_2")
+		self.cmb_source = QtWidgets.QComboBox(self.centralwidget)
+		self.cmb_source.setMinimumSize(QtCore.QSize(0, 30))
+		self.cmb_source.setMaximumSize(QtCore.QSize(16777215, 30))
+		self.cmb_source.setObjectName("cmb_source")
+		self.cmb_source.addItem("ランキング", "ranking")
+		self.cmb_source.addItem("出品レポート", "report")
+		self.horizontalLayout_2.addWidget(self.cmb_source)
+
+		self.cmb_discovery = QtWidgets.QComboBox(self.centralwidget)
+		self.cmb_discovery.setMinimumSize(QtCore.QSize(0, 30))
+		self.cmb_discovery.setMaximumSize(QtCore.QSize(16777215, 30))
+		self.cmb_discovery.setObjectName("cmb_discovery")
+		self.cmb_discovery.addItem("Chrome", "selenium")
+		self.cmb_discovery.addItem("HTTP", "http")
+		self.cmb_discovery.setCurrentIndex(max(self.cmb_discovery.findData(self.ui_handler.discovery_backend), 0))
+		self.horizontalLayout_2.addWidget(self.cmb_discovery)
+
 		self.btn_start = QtWidgets.QPushButton(self.centralwidget)
 		self.btn_start.setMinimumSize(QtCore.QSize(16777215, 30))
 		self.btn_start.setMaximumSize(QtCore.QSize(16777215, 30))
@@ -156,11 +148,26 @@ class Ui_MainWindow(object):
 		self.btn_history.setMinimumSize(QtCore.QSize(16777215, 30))
 		self.btn_history.setMaximumSize(QtCore.QSize(16777215, 30))
 		self.btn_history.setObjectName("btn_history")
-		self.btn_history.setText("以前の履歴出力")
+		self.btn_history.setText("以前の履歴")
 		self.btn_history.setEnabled(True)
-		self.btn_history.clicked.connect(self.savefile)
+		self.btn_history.clicked.connect(self.show_history)
 		self.horizontalLayout_2.addWidget(self.btn_history)
 
+		self.chk_export_matched = QtWidgets.QCheckBox(self.centralwidget)
+		self.chk_export_matched.setMaximumSize(QtCore.QSize(16777215, 30))
+		self.chk_export_matched.setObjectName("chk_export_matched")
+		self.chk_export_matched.setText("価格差ありのみ")
+		self.horizontalLayout_2.addWidget(self.chk_export_matched)
+
+		self.btn_resume = QtWidgets.QPushButton(self.centralwidget)
+		self.btn_resume.setMinimumSize(QtCore.QSize(16777215, 30))
+		self.btn_resume.setMaximumSize(QtCore.QSize(16777215, 30))
+		self.btn_resume.setObjectName("btn_resume")
+		self.btn_resume.setText("再開")
+		self.btn_resume.setEnabled(self.ui_handler.load_checkpoint() is not None)
+		self.btn_resume.clicked.connect(self.handle_btn_resume_clicked)
+		self.horizontalLayout_2.insertWidget(self.horizontalLayout_2.indexOf(self.btn_start) + 1, self.btn_resume)
+
 		self.verticalLayout.addLayout(self.horizontalLayout_2)
 		
 		self.horizontalLayout = QtWidgets.QHBoxLayout()
@@ -170,10 +177,11 @@ class Ui_MainWindow(object):
 		self.tbl_dataview.setMaximumWidth(16777215)
 		self.tbl_dataview.setMinimumWidth(16777215)
 		self.tbl_dataview.doubleClicked.connect(self.handle_cell_click)
-		header_labels = ["JAN", "URL", "在庫", "サイト価格", "Amazonの価格", "価格差"]
-		model = QtGui.QStandardItemModel(0, 5)
-		model.setHorizontalHeaderLabels(header_labels)
-		self.tbl_dataview.setModel(model)
+		self.product_model = ProductTableModel(self.tbl_dataview)
+		self.tbl_dataview.setModel(self.product_model)
+		font = QtGui.QFont()
+		font.setBold(True)
+		self.tbl_dataview.horizontalHeader().setFont(font)
 		self.horizontalLayout.addWidget(self.tbl_dataview)
 		self.verticalLayout.addLayout(self.horizontalLayout)
 
@@ -211,6 +219,16 @@ class Ui_MainWindow(object):
 
 	def closeEvent(self, event):
 		self.saveSettings()
+		# stop the crawl and let it finish the pages in flight, so its rows, checkpoint and run status are written
+		self.isStop = True
+		if self.request_thread is not None and self.request_thread.isRunning():
+			self.statusLabel.setText("停止しています...")
+			QtWidgets.QApplication.processEvents()
+			self.request_thread.wait()
+		if self.export_thread is not None and self.export_thread.isRunning():
+			self.export_thread.cancel()
+			self.export_thread.wait()
+		self.ui_handler.close()
 		event.accept()
 
 	def loadSettings(self):
@@ -232,18 +250,13 @@ class Ui_MainWindow(object):
 	def handle_cell_click(self, index):
 		row = index.row()
 		col = index.column()
-		if col == 1 and self.ui_handler.products_list[row] != "":
+		if col == 1 and self.product_model.url_at(row) != "":
 			import webbrowser
-			webbrowser.open(self.ui_handler.products_list[row]['url'])
+			webbrowser.open(self.product_model.url_at(row))
 
 	def handle_btn_start_clicked(self):
 		if self.isStop:
-			self.btn_start.setText("停止")
-			self.ui_handler.products_list = []
-			self.request_thread = RequestThread(self.ui_handler)
-			self.request_thread.request_completed.connect(self.handle_request_completed)
-			self.request_thread.start()
-			self.isStop = False
+			self.start_request(resume = False)
 		else:
 			self.isStop = True
 			self.statusLabel.setVisible(True)
@@ -252,75 +265,97 @@ class Ui_MainWindow(object):
 			self.spinner.stop()
 			self.request_thread.exit()
 
+	def handle_btn_resume_clicked(self):
+		if self.isStop:
+			self.start_request(resume = True)
+
+	def start_request(self, resume):
+		self.btn_start.setText("停止")
+		self.btn_resume.setEnabled(False)
+		self.ui_handler.products_list = []
+		self.product_model.clear()
+		self.ui_handler.discovery_backend = self.cmb_discovery.currentData()
+		self.cmb_discovery.setEnabled(False)
+		self.cmb_source.setEnabled(False)
+		self.request_thread = RequestThread(self.ui_handler, self.cmb_source.currentData(), resume)
+		self.request_thread.status_changed.connect(self.handle_status_changed)
+		self.request_thread.progress_changed.connect(self.handle_progress_changed)
+		self.request_thread.error_occurred.connect(self.handle_error_occurred)
+		self.request_thread.products_found.connect(self.handle_products_found)
+		self.request_thread.start()
+		self.isStop = False
+
 	def savefile(self):
-		filename, _ = QFileDialog.getSaveFileName(self, 'Save File', '', ".xls(*.xls)")
-		if filename:
-			wbk = xlwt.Workbook()
-			sheet = wbk.add_sheet("sheet", cell_overwrite_ok = True)
-			style = xlwt.XFStyle()
-			font = xlwt.Font()
-			font.bold = True
-			style.font = font
-			model = self.tbl_dataview.model()
-			
-			sheet.write(0, 0, 'JAN', style = style)
-			sheet.write(0, 1, 'URL', style = style)
-			sheet.write(0, 2, '在庫', style = style)
-			sheet.write(0, 3, 'サイト価格', style = style)
-			sheet.write(0, 4, 'Amazonの価格', style = style)
-			sheet.write(0, 5, '価格差', style = style)
-
-			row_count = 0
-			# for r in range(model.rowCount()):
-			# 	sheet.write((row_count + 1), 0, model.data(model.index(row_count, 0)), style = style)
-			# 	sheet.write((row_count + 1), 1, model.data(model.index(row_count, 1)), style = style)
-			# 	sheet.write((row_count + 1), 2, model.data(model.index(row_count, 2)), style = style)
-			# 	sheet.write((row_count + 1), 3, model.data(model.index(row_count, 3)), style = style)
-			# 	sheet.write((row_count + 1), 4, model.data(model.index(row_count, 4)), style = style)
-			# 	sheet.write((row_count + 1), 5, model.data(model.index(row_count, 5)), style = style)
-			# 	row_count += 1
-			conn = sqlite3.connect('database.db')
-			cur = conn.cursor()
-			cur.execute("SELECT * FROM history")
-			rows = cur.fetchall()
-			conn.close()
-
-			for row in rows:
-				sheet.write((row_count + 1), 0, row[0], style = style)
-				sheet.write((row_count + 1), 1, row[1], style = style)
-				sheet.write((row_count + 1), 2, row[2], style = style)
-				sheet.write((row_count + 1), 3, row[3], style = style)
-				sheet.write((row_count + 1), 4, row[4], style = style)
-				sheet.write((row_count + 1), 5, row[5], style = style)
-				row_count += 1
-
-			wbk.save(filename)
+		if self.export_thread is not None and self.export_thread.isRunning():
+			self.export_thread.cancel()
 			return
-	
-	def handle_request_completed(self, response_text):
-		if response_text == "start":
+
+		filename, selected_filter = QFileDialog.getSaveFileName(self, 'Save File', '', "Excel (*.xlsx);;CSV (*.csv)")
+		if filename:
+			if not filename.lower().endswith(('.xlsx', '.csv')):
+				filename += '.csv' if 'csv' in selected_filter else '.xlsx'
+
+			self.export_thread = ExportThread(filename, self.chk_export_matched.isChecked())
+			self.export_thread.export_progress.connect(self.handle_export_progress)
+			self.export_thread.export_finished.connect(self.handle_export_finished)
+			self.btn_export.setText("出力中止")
+			self.btn_export.setEnabled(True)
+			self.btn_history.setEnabled(False)
+			self.export_thread.start()
+
+	def show_history(self):
+		HistoryDialog(self).exec_()
+
+	def handle_export_progress(self, done, total):
+		self.statusLabel.setText(f"{total} 件中 {done} 件出力済み")
+
+	def handle_export_finished(self, message):
+		self.statusLabel.setText(message)
+		self.btn_export.setText("出力")
+		self.btn_history.setEnabled(self.isStop)
+		self.export_thread = None
+
+	def handle_status_changed(self, status):
+		if status == "start":
 			self.statusLabel.setText("ダウンロード中...")
 			self.btn_history.setEnabled(False)
 			self.spinner.start()
-		elif response_text == "stop":
+		elif status == "stop":
 			self.spinner.stop()
 			self.btn_start.setText("開始")
 			self.btn_export.setEnabled(True)
 			self.btn_start.setEnabled(True)
+			self.cmb_discovery.setEnabled(True)
+			self.cmb_source.setEnabled(True)
+			self.btn_resume.setEnabled(self.ui_handler.load_checkpoint() is not None)
 			self.isStop = True
-		elif response_text == "reading":
+		elif status == "reading":
 			self.progressBar.setValue(0)
 			self.statusLabel.setText("ファイルを読んでいます...")
-		elif response_text != "start" and response_text != 'stop' and response_text != 'reading' and re.findall(r'\d+', response_text) == False:
-			self.spinner.stop()
-			self.statusLabel.setText(response_text)
-		else:
-			self.spinner.stop()
-			cur_position = float(response_text) / (100 / self.total_count)
-			self.statusLabel.setText(f"{self.total_count} 個中 {round(cur_position)} 個処理済み")
-			self.progressBar.setVisible(True)
-			self.btn_export.setEnabled(True)
-			self.progressBar.setValue(round(float(response_text)))
+
+	def handle_progress_changed(self, stats):
+		self.spinner.stop()
+		slowest = ''
+		if stats.get('slowest'):
+			slowest = f" / 最遅 {stats['slowest'][0]} {stats['slowest'][1]:.0f}ms"
+		self.statusLabel.setText(
+			f"{stats['total']} 個中 {stats['position']} 個処理済み"
+			f"（一致 {stats['matched']} / スキップ {stats['skipped']} / エラー {stats['errored']} / 重複 {stats['duplicates']}）"
+			f" {stats['recent_rate']:.1f} 個/秒{slowest}"
+		)
+		self.progressBar.setVisible(True)
+		self.btn_export.setEnabled(True)
+		if stats['total'] > 0:
+			self.progressBar.setValue(round(100 * stats['position'] / stats['total']))
+
+	def handle_error_occurred(self, message):
+		self.spinner.stop()
+		self.statusLabel.setText(message)
+
+	def handle_products_found(self, products):
+		with self.ui_handler.metrics.timer('table', len(products)):
+			self.product_model.append_rows(products)
+		self.btn_export.setEnabled(True)
 
 	def retranslateUi(self, MainWindow):
 		_translate = QtCore.QCoreApplication.translate
@@ -1,60 +1,212 @@
-import gzip
-import os
-import re
-import sqlite3
 import time
+import zlib
 import requests
 import logging
 
 
 import config
-
-from subprocess import CREATE_NO_WINDOW
-from pathlib import Path
-from PyQt5 import QtWidgets, QtGui
-from bs4 import BeautifulSoup
-
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
+import bookoff_parser
+
+from asin_discovery import HttpAsinDiscovery
+from batcher import AsinBatcher
+from bookoff_cache import BookOffCache
+from catalog_cache import CatalogCache
+from driver_pool import ChromeDriverPool
+from history_writer import HistoryWriter
+from http_client import HttpClient
+from metrics import Metrics
+from rate_limiter import SpApiScheduler
+from report_stream import iter_gunzip, iter_lines, iter_listing_rows
+from seen_set import SeenSet
+from token_cache import AccessTokenCache
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+logger = logging.getLogger('action')
+
+# sales rank browse pages (path on AMAZON_URL): DVD, music, software
+BROWSE_URLS = {
+	'561958': '/s?i=dvd&rh=n%3A561958&s=salesrank{page}&page=2&applicationType=BROWSER&deviceOS=Windows&handlerName=BrowsePage&pageId=561958&pageType=Browse&qid=1696132034&softwareClass=Web+Browser&ref=sr_pg_2',
+	'561956': '/s?rh=n%3A561956&s=salesrank{page}&language=en&applicationType=BROWSER&deviceOS=Windows&handlerName=BrowsePage&pageId=561956&pageType=Browse&softwareClass=Web+Browser&ref=nav_em__mu_0_2_5_6',
+	'689132': '/s?i=software&rh=n%3A689132&s=salesrank{page}&language=en&applicationType=BROWSER&deviceOS=Windows&handlerName=BrowsePage&pageId=689132&pageType=Browse&qid=1695891292&softwareClass=Web+Browser&ref=sr_pg_2',
+}
+
+# id shared by all history rows of one run
+def new_run_id():
+	return time.strftime('%Y%m%d%H%M%S')
 
 class ActionManagement:
 	products_list = []
 	cur_page = 0
-	temp_arr = []
-	document_folder = Path.home() / "Documents"
-	amazon_folder = document_folder / "Amazon"
+	cur_category = ''
+	last_row = 0
+	run_id = ''
 	
-	def __init__ (self, main_window):
+	def __init__ (self, main_window = None):
 		self.main_window = main_window
 		self.refresh_token = config.REFRESH_TOKEN
 		self.client_id = config.CLIENT_ID
 		self.client_secret = config.CLIENT_SECRET
 		self.access_token = ''
-		self.api_url = "https://sellingpartnerapi-fe.amazon.com"
+		# endpoints, pointed at the stub server by benchmark.py
+		self.api_url = getattr(config, 'SP_API_URL', "https://sellingpartnerapi-fe.amazon.com")
+		self.token_url = getattr(config, 'LWA_TOKEN_URL', "https://api.amazon.co.jp/auth/o2/token")
+		self.amazon_url = getattr(config, 'AMAZON_URL', "https://www.amazon.co.jp")
+		self.bookoff_url = getattr(config, 'BOOKOFF_URL', bookoff_parser.BASE_URL)
+		bookoff_workers = getattr(config, 'BOOKOFF_WORKERS', 8)
+		self.bookoff_workers = bookoff_workers
+		self.bookoff_in_flight = max(getattr(config, 'BOOKOFF_MAX_IN_FLIGHT', 32), bookoff_workers)
+		# concurrent catalog/pricing batches in the crawl pipeline, still bound by the SP-API rate limits
+		self.catalog_workers = getattr(config, 'CATALOG_WORKERS', 2)
+		self.pricing_source = getattr(config, 'PRICING_SOURCE', 'competitive')  # 'competitive' or 'offers' (getItemOffersBatch)
+		self.price_fetch = getattr(config, 'PRICE_FETCH', 'concurrent')  # 'concurrent' or 'missing' (only items without list_price)
+		self.pricing_executor = ThreadPoolExecutor(max_workers = self.catalog_workers, thread_name_prefix = 'pricing')
+		self.http = HttpClient(
+			pool_sizes = getattr(config, 'HTTP_POOL_SIZES', {urlsplit(self.bookoff_url).netloc: bookoff_workers}),
+			default_pool_size = getattr(config, 'HTTP_DEFAULT_POOL_SIZE', 10),
+			timeout = getattr(config, 'HTTP_TIMEOUT', (5, 30))
+		)
+		self.sp_api = SpApiScheduler(
+			self.http,
+			limits = getattr(config, 'SP_API_LIMITS', None),
+			max_retries = getattr(config, 'SP_API_MAX_RETRIES', 8),
+			on_rejected = self.token_rejected,
+			access_token = self.get_access_token
+		)
+		self.token_cache = AccessTokenCache(
+			self.request_access_token,
+			refresh_margin = getattr(config, 'TOKEN_REFRESH_MARGIN', 300)
+		)
+		self.page_prefetch = getattr(config, 'CHROME_DRIVERS', 2)
+		self.driver_pool = ChromeDriverPool(
+			size = self.page_prefetch,
+			max_pages = getattr(config, 'CHROME_MAX_PAGES', 50),
+			wait_timeout = getattr(config, 'CHROME_WAIT_TIMEOUT', 10)
+		)
+		self.http_discovery = HttpAsinDiscovery(self.http)
+		self.discovery_backend = getattr(config, 'DISCOVERY_BACKEND', 'selenium')  # 'selenium' or 'http'
+		# searchCatalogItems and competitivePrice both take up to 20 asins
+		self.batch_size = min(getattr(config, 'CATALOG_BATCH_SIZE', 20), getattr(config, 'PRICING_BATCH_SIZE', 20))
+		self.batcher = AsinBatcher(self.batch_size, max_wait = getattr(config, 'BATCH_MAX_WAIT', 60.0))
+		# cached asins of which only the price needs refreshing, sent to the pricing API alone
+		self.price_batcher = AsinBatcher(self.batch_size, max_wait = getattr(config, 'BATCH_MAX_WAIT', 60.0))
+		self.catalog_cache = CatalogCache('database.db', ttl = getattr(config, 'CATALOG_TTL', None))
+		self.bookoff_parser = getattr(config, 'BOOKOFF_PARSER', 'fast')  # 'fast' or 'soup'
+		self.bookoff_cache = BookOffCache(
+			'database.db',
+			ttl = getattr(config, 'BOOKOFF_CACHE_TTL', 24 * 3600),
+			negative_ttl = getattr(config, 'BOOKOFF_NEGATIVE_TTL', 7 * 24 * 3600)
+		)
+		# asins and jans handled in this run, skipped when they come up again
+		self.seen = SeenSet(
+			capacity = getattr(config, 'DEDUP_CAPACITY', 2000000),
+			error_rate = getattr(config, 'DEDUP_ERROR_RATE', 1e-7),
+			enabled = getattr(config, 'DEDUP', True)
+		)
+		# per-stage timings, written to METRICS_FILE every METRICS_INTERVAL seconds
+		self.metrics = Metrics(window = getattr(config, 'METRICS_WINDOW', 1000))
+		self.metrics_file = getattr(config, 'METRICS_FILE', 'metrics.json')
+		self.metrics_interval = getattr(config, 'METRICS_INTERVAL', 10.0)
+		self.history_writer = HistoryWriter(
+			'database.db',
+			batch_size = getattr(config, 'HISTORY_BATCH_SIZE', 500),
+			flush_interval = getattr(config, 'HISTORY_FLUSH_INTERVAL', 2.0),
+			metrics = self.metrics,
+			keep_runs = getattr(config, 'HISTORY_KEEP_RUNS', None)
+		)
+		self.history_writer.prepare()
+
+	# prepare a new run, or pick up the run of the checkpoint
+	def start_run(self, checkpoint = None, mode = 'ranking'):
+		self.last_row = 0
+		self.metrics.reset()
+		if checkpoint:
+			self.run_id = checkpoint.get('run_id') or new_run_id()
+			self.cur_page = checkpoint['page']
+			self.cur_category = checkpoint['category']
+			self.last_row = checkpoint['last_row']
+			self.batcher.reset(checkpoint['pending'])
+			self.price_batcher.reset()
+			self.seen.reset(self.history_writer.load_seen(self.run_id))
+			self.history_writer.start(self.run_id, mode, resume_after = checkpoint['last_row'])
+		else:
+			self.run_id = new_run_id()
+			self.cur_page = 0
+			self.cur_category = ''
+			self.batcher.reset()
+			self.price_batcher.reset()
+			self.seen.reset()
+			self.history_writer.start(self.run_id, mode, reset = True)
+
+	# join a run started by another process (sharded crawl), keeping its history
+	def start_shard(self, run_id):
+		self.run_id = run_id
+		self.last_row = 0
+		self.metrics.reset()
+		self.batcher.reset()
+		self.price_batcher.reset()
+		self.seen.reset()
+		self.history_writer.start(run_id)
+
+	# share SP-API rate limit buckets with other processes
+	def use_rate_limit_buckets(self, buckets):
+		self.sp_api = SpApiScheduler(
+			self.http,
+			limits = getattr(config, 'SP_API_LIMITS', None),
+			max_retries = getattr(config, 'SP_API_MAX_RETRIES', 8),
+			buckets = buckets,
+			on_rejected = self.token_rejected,
+			access_token = self.get_access_token
+		)
+
+	# checkpoint of the last run that did not finish, or None
+	def load_checkpoint(self):
+		return self.history_writer.load_checkpoint()
+
+	# record where the crawl is, committed with the rows saved so far
+	# (page, its category and pending as of that position, when the crawl already ran ahead; seen: asins/jans handled
+	# since the last one; last_row: row id of the last product before it, rows after it are dropped on resume)
+	def save_checkpoint(self, mode, position, report_document_id = '', page = None, pending = None, seen = (), last_row = None,
+						category = None):
+		self.history_writer.write_checkpoint({
+			'mode': mode,
+			'position': position,
+			'page': self.cur_page if page is None else page,
+			'category': self.get_category(position) if category is None else category,
+			'pending': self.pending_asins() if pending is None else list(pending),
+			'last_row': self.last_row if last_row is None else last_row,
+			'report_document_id': report_document_id,
+			'run_id': self.run_id,
+		}, seen)
+
+	# the run went through to the end, nothing to resume
+	def clear_checkpoint(self):
+		self.history_writer.write_checkpoint(None)
+
+	# persist everything of the current run; status ('finished', 'stopped' or 'failed') goes to the run list
+	def finish_run(self, status = None):
+		self.history_writer.stop(status)
+
+	# release drivers, workers and connections
+	def close(self):
+		self.pricing_executor.shutdown(wait = False, cancel_futures = True)
+		self.history_writer.stop()
+		self.catalog_cache.close()
+		self.bookoff_cache.close()
+		self.driver_pool.close()
+		self.http.close()
 	
-	# drow table
-	def draw_table(self, products):
-		table = self.main_window.findChild(QtWidgets.QTableView, "tbl_dataview")
-        
-		model = QtGui.QStandardItemModel(len(products), 5)  # Adjust the number of columns accordingly
-		model.setHorizontalHeaderLabels(["JAN", "URL", "在庫", "サイト価格", "Amazonの価格", "価格差"])
-
-		for row, product in enumerate(products):
-			for col, key in enumerate(['jan', 'url', 'stock', 'site_price', 'amazon_price', 'price_status']):  # This should be a list, not a set
-				item = QtGui.QStandardItem(product.get(key, ""))  # Convert 'product' to a string
-				item.setEditable(False)
-				model.setItem(row, col, item)
-
-		table.setModel(model)
-		header = table.horizontalHeader()
-		font = QtGui.QFont()
-		font.setBold(True)
-		header.setFont(font)
-
-	# get Access Token
+	# get Access Token (cached until shortly before it expires)
 	def get_access_token(self):
-		url = "https://api.amazon.co.jp/auth/o2/token"
+		return self.token_cache.get()
+
+	# SP-API refused the token it was sent, so the next call fetches a new one
+	def token_rejected(self, response):
+		self.token_cache.invalidate(response.request.headers.get('x-amz-access-token'))
+
+	# request a new Access Token from LWA
+	def request_access_token(self):
+		url = self.token_url
 		payload = {
             "grant_type": "refresh_token",
             "refresh_token": self.refresh_token,
@@ -62,20 +214,26 @@ class ActionManagement:
             "client_id": self.client_id,
             "client_secret": self.client_secret,
         }
-		response = requests.post(url, data=payload)
-		access_token = response.json().get("access_token")
-
+		try:
+			with self.metrics.timer('token'):
+				response = self.http.post(url, data=payload)
+			token = response.json()
+		except (requests.exceptions.RequestException, ValueError) as e:
+			logger.warning('Token error: %s', e)
+			return '', 0
+
+		access_token = token.get("access_token")
 		if access_token:
-			return access_token
+			return access_token, int(token.get("expires_in", 3600))
 		else:
-			return ''
+			return '', 0
 
 	# get report document id
 	def get_report_document_id(self, access_token):
 		url = f"{self.api_url}/reports/2021-06-30/reports"
 		headers = {"Accept": "application/json", "x-amz-access-token": f"{access_token}"}
 		params = {"reportTypes": "GET_MERCHANT_LISTINGS_ALL_DATA"}
-		response = requests.get(url, headers=headers, params=params)
+		response = self.sp_api.get('getReports', url, headers=headers, params=params)
 
 		if response.status_code == 200:
 			reports = response.json()
@@ -88,7 +246,7 @@ class ActionManagement:
 	def get_report_gz_url(self, report_document_id, access_token):
 		url = f"{self.api_url}/reports/2021-06-30/documents/{report_document_id}"
 		headers = {"Accept": "application/json", "x-amz-access-token": f"{access_token}"}
-		response = requests.get(url, headers=headers)
+		response = self.sp_api.get('getReportDocument', url, headers=headers)
 
 		if response.status_code == 200:
 			report_doc = response.json()["url"]
@@ -96,75 +254,30 @@ class ActionManagement:
 		else:
 			return ''
 
-	# donwload gz file
-	def download_report_document_file(self, url, filepath):
-		try:
-			if not self.amazon_folder.exists():
-				self.amazon_folder.mkdir(parents=True)
-			
-			filepath = self.amazon_folder / filepath
-
-			response = requests.get(url, stream=True)
-			response.raise_for_status()
-
-			with open(filepath, "wb") as file:
-				for chunk in response.iter_content(chunk_size=1024):
-					if chunk:
-						file.write(chunk)
-			return True
-		except requests.exceptions.RequestException as e:
-			return False
-		except IOError as e:
-			return False
-		except Exception as e:
-			return False
-
-	# unzip gz file
-	def unzip_report_document_file(self, gz_filepath, extracted_filepath):
-		try:
-            # os.chmod(extracted_filepath, 0o666)
-			filepath = self.amazon_folder / gz_filepath
-			extracted_filepath = self.amazon_folder / extracted_filepath
-
-			with gzip.open(filepath, 'rb') as gz_file:
-				with open(extracted_filepath, 'wb') as output_file:
-					output_file.write(gz_file.read())
-			os.remove(filepath)
-			return ''
-		except PermissionError as e:
-			return f'Permission error: {e}'
-		except Exception as e:
-			return f'An error occurred: {e}'
+	# download, decompress and parse the report in one pass
+	def iter_report_document_rows(self, url):
+		response = self.http.get(url, stream=True)
+		response.raise_for_status()
+		with response:
+			chunks = response.iter_content(chunk_size=64 * 1024)
+			yield from iter_listing_rows(iter_lines(iter_gunzip(chunks)))
 
-	# get product total count
-	def get_content_from_file(self, origin_filepath):
+	# get asins of active listings from the report document
+	def load_report_document(self, url):
 		try:
-			i = 0
-			cnt = 0
-			filepath = self.amazon_folder / origin_filepath
-			with open(filepath, 'r', encoding='utf-8') as file:
-				for line in file.readlines():
-					line = line.strip().split(',')
-					fields = line[0].split('\t')
-					
-					if i >= 1 and len(fields) >= 2 and fields[-1] == 'Active' and fields[-2] == '送料無料(お急ぎ便無し)':
-						cnt += 1
-					i += 1
-					
-			result = {
-                'filepath': origin_filepath,
-                'total': cnt,
-            }
-			return result
-		except FileNotFoundError:
-			return ''
-		except Exception as e:
-			return ''
-
-	# get Jan code by asin code
+			return [fields[1] for fields in self.iter_report_document_rows(url)]
+		except requests.exceptions.RequestException as e:
+			logger.warning('Request error: %s', e)
+			return None
+		except zlib.error as e:
+			logger.warning('Decompress error: %s', e)
+			return None
+
+	# get Jan code by asin code, with the price joined by asin
+	# (catalog and pricing run side by side unless only missing list prices are fetched)
 	def get_jan_code_by_asin(self, temp_asin_arr, asins):
-		print(asins)
-		url = "https://sellingpartnerapi-fe.amazon.com/catalog/2022-04-01/items"
+		logger.debug('catalog batch: %s', asins)
+		url = f"{self.api_url}/catalog/2022-04-01/items"
 		headers = {
             "x-amz-access-token": self.access_token,
             "Accept": "application/json"
@@ -176,72 +289,64 @@ class ActionManagement:
             "identifiersType": "ASIN",
             "identifiers": asins
         }
-		response = requests.get(url, headers=headers, params=params)
-		# result_arr = [['', '', '', '']] * len(temp_asin_arr) # 1. jan code, 2. category, 3. ranking, 4. price
-		result_arr = []
-		price_arr = []
-		
-		if response.status_code == 200:
-			json_response = response.json()
-			if (len(json_response['items']) > 0):
-				price_arr = self.get_competitivePrice(asins)
-				
-				for i in range(len(json_response['items'])):
-					product = json_response['items'][i]
-					price = product['attributes']['list_price'][0]['value'] if 'list_price' in product['attributes'] else '0'
-					if(price == '0'):
-						price = price_arr[i]
-					
-					temp = [
-						product['identifiers'][0]['identifiers'][0]['identifier'] if len(product['identifiers'][0]['identifiers']) > 0 else '',
-						product['salesRanks'][0]['displayGroupRanks'][0]['title'] if len(product['salesRanks'][0]['displayGroupRanks']) > 0 else '',
-						product['salesRanks'][0]['displayGroupRanks'][0]['rank'] if len(product['salesRanks'][0]['displayGroupRanks']) > 0 else '',
-						price
-					]
-					result_arr.append(temp)
-				return result_arr
-
-				# price_arr = self.get_competitivePrice(asins)
-				# if price_arr is None:
-				# 	price_arr = [0] * len(temp_asin_arr)
-				
-				# price = 0
-				# for product in json_response['items']:
-				# 	print(f"product => {product['asin']}")
-				# 	for i in range(len(temp_asin_arr)):
-				# 		if len(price_arr) > 0:
-				# 			print(f"before => {price_arr[i]}")
-				# 			if(int(price_arr[i]) != 0):
-				# 				price = price_arr[i]
-				# 			else:
-				# 				print(f"after => {product['attributes']['list_price'][0]['value'] if 'list_price' in product['attributes'] else '0'}")
-				# 				price = product['attributes']['list_price'][0]['value'] if 'list_price' in product['attributes'] else '0'
-				# 		print(f"current => {price}")
-
-				# 		if(temp_asin_arr[i] == product['asin']):
-				# 			print(f"selected => {price} asin = {temp_asin_arr[i]}")
-				# 			print(len(result_arr))
-				# 			print(i)
-				# 			print('selected')
-				# 			result_arr[len(result_arr) - len(result_arr) + i] = [
-				# 				product["identifiers"][0]["identifiers"][0]["identifier"]
-				# 				if product.get("identifiers") else "",
-				# 				product["salesRanks"][0]["displayGroupRanks"][0]["title"]
-				# 				if product.get("salesRanks") else "",
-				# 				product["salesRanks"][0]["displayGroupRanks"][0]["rank"]
-				# 				if product.get("salesRanks") else "",
-				# 				price
-				# 			]
-				# 	print(result_arr)
-				# return result_arr
-			else:
-				return ''
-		else:
+		price_future = None
+		if self.price_fetch == 'concurrent':
+			price_future = self.pricing_executor.submit(self.get_prices, temp_asin_arr)
+
+		try:
+			with self.metrics.timer('catalog', len(temp_asin_arr)):
+				response = self.sp_api.get('searchCatalogItems', url, headers=headers, params=params)
+		except Exception:
+			if price_future is not None:
+				price_future.cancel()
+			raise
+
+		# a token that is still refused after the scheduler renewed it fails the batch instead of emptying it
+		if response.status_code in (401, 403):
+			if price_future is not None:
+				price_future.cancel()
+			response.raise_for_status()
+
+		items = response.json()['items'] if response.status_code == 200 else []
+		if len(items) == 0:
+			if price_future is not None:
+				price_future.cancel()
 			return ''
 
-	# Get Price of Other sellers
+		if price_future is not None:
+			prices = price_future.result()
+		else:
+			missing = [product['asin'] for product in items if 'list_price' not in product['attributes']]
+			prices = self.get_prices(missing) if len(missing) > 0 else {}
+
+		# 1. jan code, 2. category, 3. ranking, 4. price
+		fetched = {}
+		priced = set()
+		for product in items:
+			price = product['attributes']['list_price'][0]['value'] if 'list_price' in product['attributes'] else '0'
+			if(price == '0'):
+				price = prices.get(product['asin'], 0)
+				priced.add(product['asin'])
+
+			fetched[product['asin']] = [
+				product['identifiers'][0]['identifiers'][0]['identifier'] if len(product['identifiers'][0]['identifiers']) > 0 else '',
+				product['salesRanks'][0]['displayGroupRanks'][0]['title'] if len(product['salesRanks'][0]['displayGroupRanks']) > 0 else '',
+				product['salesRanks'][0]['displayGroupRanks'][0]['rank'] if len(product['salesRanks'][0]['displayGroupRanks']) > 0 else '',
+				price
+			]
+		self.catalog_cache.put_many(fetched, priced)
+		# in the order asked for, whatever order the catalog answered in
+		return [fetched[asin] for asin in temp_asin_arr if asin in fetched]
+
+	# prices of other sellers by asin from the configured endpoint
+	def get_prices(self, asin_arr):
+		if self.pricing_source == 'offers':
+			return self.get_item_offers_batch(asin_arr)
+		return self.get_competitivePrice(self.convert_array_to_string(asin_arr))
+
+	# Get Price of Other sellers as {asin: price}
 	def get_competitivePrice(self, asins):
-		url = "https://sellingpartnerapi-fe.amazon.com/products/pricing/v0/competitivePrice"
+		url = f"{self.api_url}/products/pricing/v0/competitivePrice"
 		headers = {
             "x-amz-access-token": self.access_token,
             "Accept": "application/json"
@@ -251,234 +356,251 @@ class ActionManagement:
             "Asins": asins,
             "ItemType": 'Asin'
         }
-		response = requests.get(url, headers=headers, params=params)
-		result_arr = []
+		with self.metrics.timer('pricing', asins.count(',') + 1):
+			response = self.sp_api.get('getCompetitivePricing', url, headers=headers, params=params)
+		result = {}
 
 		if response.status_code == 200:
 			json_response = response.json()
 			for product in json_response['payload']:
+				if product.get('status') != 'Success' or 'Product' not in product:
+					continue
 				if(len(product['Product']['CompetitivePricing']['CompetitivePrices']) > 0):
 					price = product['Product']['CompetitivePricing']['CompetitivePrices'][0]['Price']['ListingPrice']['Amount']
-					result_arr.append(int(price))
+					result[product['ASIN']] = int(price)
 				else:
-					result_arr.append(0)
+					result[product['ASIN']] = 0
 
-			return result_arr
-		else:
-			return result_arr
+		return result
+
+	# Get buy box (or lowest new) price of up to 20 asins in one getItemOffersBatch call as {asin: price}
+	def get_item_offers_batch(self, asin_arr):
+		url = f"{self.api_url}/batches/products/pricing/v0/itemOffers"
+		headers = {
+            "x-amz-access-token": self.access_token,
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        }
+		body = {
+			"requests": [
+				{
+					"uri": f"/products/pricing/v0/items/{asin}/offers",
+					"method": "GET",
+					"MarketplaceId": config.MAKETPLACEID,
+					"ItemCondition": "New",
+					"CustomerType": "Consumer"
+				}
+				for asin in asin_arr
+			]
+		}
+		with self.metrics.timer('pricing', len(asin_arr)):
+			response = self.sp_api.request('getItemOffersBatch', 'POST', url, headers=headers, json=body)
+		result = {}
+
+		if response.status_code == 200:
+			for item in response.json()['responses']:
+				if item['status']['statusCode'] != 200:
+					continue
+				payload = item['body']['payload']
+				summary = payload.get('Summary', {})
+				prices = summary.get('BuyBoxPrices') or summary.get('LowestPrices') or []
+				amounts = [price['ListingPrice']['Amount'] for price in prices if 'ListingPrice' in price]
+				result[payload['ASIN']] = int(min(amounts)) if len(amounts) > 0 else 0
+
+		return result
 
 	# convert array to str
 	def convert_array_to_string(self, arr):
-		result_str = ''
-		for i in range(len(arr)):
-			if(i == 0):
-				result_str += arr[i]
-			else:
-				result_str += f",{arr[i]}"
-				
-		return result_str
+		return ','.join(arr)
 
 	# get product list from amazon
-	def product_list_download_from_amazon(self):
+	def product_list_download_from_amazon(self, report_document_id = ''):
 		self.access_token = self.get_access_token()
 		if(self.access_token == ''):
 			return 'アクセストークンを取得できませんでした。'
 		
-		report_document_id = self.get_report_document_id(self.access_token)
-		if(report_document_id == ''):
-			return 'report document idを取得できません。'
-		
-		report_document_url = self.get_report_gz_url(report_document_id, self.access_token)
+		try:
+			if(report_document_id == ''):
+				report_document_id = self.get_report_document_id(self.access_token)
+			if(report_document_id == ''):
+				return 'report document idを取得できません。'
+
+			report_document_url = self.get_report_gz_url(report_document_id, self.access_token)
+		except (requests.exceptions.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+			logger.warning('Report error: %s', e)
+			return f'レポートを取得できません。({e})'
 		if(report_document_url == ''):
 			return 'リストファイルのパスを取得できません。'
 		
-		download_flag = self.download_report_document_file(report_document_url, f"{report_document_id}.gz")
-		if(download_flag == False):
+		asin_arr = self.load_report_document(report_document_url)
+		if(asin_arr is None):
 			return 'ファイルをダウロドしていた途中にエラーが発生しました。'
 		
-		unzip_flag = self.unzip_report_document_file(f"{report_document_id}.gz", f"{report_document_id}")
-		if(unzip_flag != ''):
-			return unzip_flag
-		
-		result = self.get_content_from_file(f"{report_document_id}")
-		if(result == ''):
-			return '無効なファイルです'
-		
-		return result
-
-	# get product list from file
-	def read_product_list_from_file(self, filepath):
-		try:
-			i = 0
-			filepath = self.amazon_folder / filepath
-			with open(filepath, 'r', encoding='utf-8') as file:
-				for line in file.readlines():
-					line = line.strip().split(',')
-					fields = line[0].split('\t')
-					
-					if i >= 1 and len(fields) >= 2 and fields[-1] == 'Active' and fields[-2] == '送料無料(お急ぎ便無し)':
-						self.products_list.append(fields[1])
-					i += 1
-			return 'success'
-		except FileNotFoundError as e:
-			return e
-		except Exception as e:
-			return e
-	
-	# get product info
-	def get_product_info_by_product_list(self, position):
-		cnt = 0
-		asin_arr = []
-		asins = ''
-		for asin in self.products_list:
-			if(position >= cnt):
-				if(position == cnt):
-					self.access_token = self.get_access_token()
-				
-				if(cnt == (position + 20)):
-					break
-				
-				asin_arr.append(asin)
-			cnt += 1
-
-		asins = self.convert_array_to_string(asin_arr)
-		result = self.get_jan_code_by_asin(asin_arr, asins)
+		self.products_list = asin_arr
+		result = {
+            'filepath': report_document_id,
+            'total': len(asin_arr),
+        }
 		return result
 
-	# get product url
-	def get_product_url(self, product, cur_position):
-		try:
-			conn = sqlite3.connect('database.db')
-			cursor = conn.cursor()
-
-			if cur_position == 1:
-				table = cursor.execute("SELECT * FROM sqlite_master WHERE name='history'")
-				rows = table.fetchall()
-				if len(rows) == 0:
-					cursor.execute("CREATE TABLE history (id integer, jan text, url text, stock text, site_price text, amazon_price text, price_status text)")
-					conn.commit()
-				else:
-					cursor.execute("DELETE FROM history")
-					conn.commit()
-
-			key_code = product[0]
-			other_price = int(product[3])
+	# iterate the loaded product list in fixed size batches of (position, asins)
+	def iter_product_batches(self, offset = 0, size = 20):
+		for position in range(offset, len(self.products_list), size):
+			yield position, self.products_list[position:position + size]
+
+	# parse the first search result of a bookoff page, None when nothing was found
+	def parse_bookoff_page(self, content):
+		with self.metrics.timer('parse'):
+			if self.bookoff_parser == 'soup':
+				return bookoff_parser.parse_bookoff_page_soup(content)
+			return bookoff_parser.parse_bookoff_page(content)
+
+	# get bookoff search result of a jan, served from the cache while fresh
+	def lookup_bookoff_item(self, key_code):
+		cached = self.bookoff_cache.get(key_code)
+		headers = {}
+		if cached:
+			item, etag, last_modified, fresh = cached
+			if fresh:
+				return item
+			if etag:
+				headers['If-None-Match'] = etag
+			if last_modified:
+				headers['If-Modified-Since'] = last_modified
+
+		with self.metrics.timer('bookoff'):
+			res = self.http.get(f'{self.bookoff_url}/search/keyword/{key_code}', headers=headers)
+
+		if res.status_code == 304 and cached:
+			self.bookoff_cache.touch(key_code)
+			return cached[0]
+
+		if res.status_code == 200:
+			item = self.parse_bookoff_page(res.content)
+			self.bookoff_cache.put(key_code, item, res.headers.get('ETag'), res.headers.get('Last-Modified'))
+			return item
+		return None
+
+	# get product url (safe to call from lookup pool workers, raises on request errors)
+	def fetch_product_url(self, product):
+		key_code = product[0]
+		if key_code == '':
+			return None
+
+		other_price = int(product[3])
+		item = self.lookup_bookoff_item(key_code)
+		if item is None:
+			return None
+
+		price = item['price']
+		price_status = ''
+		if other_price > price:
+			percent = price / (other_price / 100)
 			
-			res = requests.get(f'https://shopping.bookoff.co.jp/search/keyword/{key_code}')
-			
-			if res.status_code == 200:
-				page = BeautifulSoup(res.content, "html.parser")
-				
-				product_url = page.find(class_='productItem__link')
-				
-				if product_url:
-					product_url = "https://shopping.bookoff.co.jp" + product_url.get('href')
-				else:
-					return
-				
-				price_element = page.find(class_='productItem__price').text
-				stock_element = page.find_all(class_="productItem__stock--alert")
-				price_element = price_element.replace(',', '')
-				price = int(re.findall(r'\d+', price_element)[0])
-				stock = '在庫なし' if stock_element else ''
-				
-				price_status = ''
-				if other_price > price:
-					percent = price / (other_price / 100)
-					
-					if (100 - percent) >= 35:
-						price_status = 'T'
-				
-					product_data = {
-						'jan': key_code,
-						'url': product_url,
-						'stock': stock,
-						'site_price': str(price),
-						'amazon_price': str(other_price),
-						'price_status': price_status
-					}
-					self.products_list.append(product_data)
-
-					# Insert data into the database
-					cursor.execute("INSERT INTO history (id, jan, url, stock, site_price, amazon_price, price_status) "
-								"VALUES (?, ?, ?, ?, ?, ?, ?)",
-								(cur_position, key_code, product_url, stock, price, other_price, price_status))
-					conn.commit()
-					
-					self.draw_table(self.products_list)
+			if (100 - percent) >= 35:
+				price_status = 'T'
 		
-		except sqlite3.Error as e:
-			print(f"SQLite error: {e}")
-		except requests.RequestException as e:
-			print(f"Request error: {e}")
-		finally:
-			conn.close()
-		# else:
-			# self.products_list.append("Not Scraped !")
-			# self.draw_table(self.products_list)
-
-	# array append and depend
-	def array_append_and_depend(self, asin_array):
-		if len(asin_array) > 0:
-			self.temp_arr = self.temp_arr + asin_array
-		if(len(self.temp_arr) >= 10):
-			result = self.temp_arr[0:10]
-			self.temp_arr = self.temp_arr[10:len(self.temp_arr)]
-			return result
-		else:
-			length = len(self.temp_arr)
-			result = self.temp_arr[0:length]
-			return result
-
-	# get product list
-	def get_products_list(self, cur_posotion):
+			return {
+				'jan': key_code,
+				'url': item['url'],
+				'stock': item['stock'],
+				'site_price': str(price),
+				'amazon_price': str(other_price),
+				'price_status': price_status
+			}
+		return None
+
+	# get product url for the lookup pool as (product_data, error)
+	def lookup_product(self, product):
+		try:
+			return self.fetch_product_url(product), None
+		except Exception as e:
+			return None, e
+
+	# save product (called in order from the request thread)
+	def save_product(self, product_data, cur_position):
+		self.last_row = cur_position
+		self.history_writer.write((
+			cur_position,
+			product_data['jan'],
+			product_data['url'],
+			product_data['stock'],
+			int(product_data['site_price']),
+			int(product_data['amazon_price']),
+			product_data['price_status']
+		))
+
+	# get sales rank category (browse node) of a position
+	def get_category(self, cur_posotion):
+		category = '561958'
+		if(cur_posotion >= 300000):
+			category = '689132'
+		elif (cur_posotion >= 150000):
+			category = '561956'
+		return category
+
+	# get sales rank page url
+	def get_browse_url(self, category, page_number):
 		page = ''
-		if self.cur_page == 1:
+		if page_number == 1:
 			page = ''
 		else:
-			page = '&page=' + str(self.cur_page)
+			page = '&page=' + str(page_number)
 		
-		print(page)
-		print(cur_posotion)
-		url = f'https://www.amazon.co.jp/s?i=dvd&rh=n%3A561958&s=salesrank{page}&page=2&applicationType=BROWSER&deviceOS=Windows&handlerName=BrowsePage&pageId=561958&pageType=Browse&qid=1696132034&softwareClass=Web+Browser&ref=sr_pg_2'
-		if(cur_posotion >= 150000):
-			url = f'https://www.amazon.co.jp/s?rh=n%3A561956&s=salesrank{page}&language=en&applicationType=BROWSER&deviceOS=Windows&handlerName=BrowsePage&pageId=561956&pageType=Browse&softwareClass=Web+Browser&ref=nav_em__mu_0_2_5_6'
-		elif (cur_posotion >= 300000):
-			url = f'https://www.amazon.co.jp/s?i=software&rh=n%3A689132&s=salesrank{page}&language=en&applicationType=BROWSER&deviceOS=Windows&handlerName=BrowsePage&pageId=689132&pageType=Browse&qid=1695891292&softwareClass=Web+Browser&ref=sr_pg_2'		
-
-		# logging.basicConfig(filename='selenium.log', level=logging.INFO)
-		chrome_options = Options()
-		chrome_options.add_argument("--headless=new")
-		chrome_options.add_argument("--disable-gpu")
-		chrome_options.add_argument("--no-sandbox")
-		chrome_options.add_argument("--window-size=0,0")
-		chrome_options.creationflags = CREATE_NO_WINDOW
-		chrome_options.experimental_options
-		driver = webdriver.Chrome(options = chrome_options)
-
-		asin_arr = []
-		asins = ''
-
-		try:
-			driver.get(url)
-			time.sleep(3)
-			product_elements = driver.find_elements(By.CLASS_NAME, 's-asin')
-			for product_element in product_elements:
-				asin = product_element.get_attribute('data-asin')
-				asin_arr.append(asin)
-
-			print(asin_arr)
-			if(len(asin_arr) > 0):
-				asin_arr = self.array_append_and_depend(asin_arr)
-			else:
-				asin_arr = self.array_append_and_depend([])
-
-			print(asin_arr)
-			print(self.temp_arr)
-			asins = self.convert_array_to_string(asin_arr)
+		return self.amazon_url + BROWSE_URLS[category].format(page = page)
+
+	# get asins of a sales rank page with the selected backend
+	def fetch_asins(self, url):
+		if self.discovery_backend == 'http':
+			with self.metrics.timer('page_http'):
+				asin_arr = self.http_discovery.fetch_asins(url)
+			if asin_arr is not None:
+				return asin_arr
+		with self.metrics.timer('page_load'):
+			return self.driver_pool.fetch_asins(url)
+
+	# get product info of catalog batches and of pricing batches (cached asins with a stale price)
+	def get_product_info_by_batches(self, batches, price_batches = ()):
+		product_list = []
+		for asin_arr in batches:
 			self.access_token = self.get_access_token()
-			return self.get_jan_code_by_asin(asin_arr, asins)
-		except Exception as e:
-			print(e)
-		finally:
-			driver.quit()
+			asins = self.convert_array_to_string(asin_arr)
+			result = self.get_jan_code_by_asin(asin_arr, asins)
+			if result:
+				product_list.extend(result)
+		for asin_arr in price_batches:
+			product_list.extend(self.refresh_prices(asin_arr))
+		return product_list
+
+	# product info of cached asins with a fresh price from the pricing API
+	def refresh_prices(self, asin_arr):
+		self.access_token = self.get_access_token()
+		prices = self.get_prices(asin_arr)
+		rows = self.catalog_cache.get_many(asin_arr)
+		prices = {asin: prices.get(asin, 0) for asin in asin_arr if asin in rows}
+		self.catalog_cache.put_prices(prices)
+		return [rows[asin][:3] + [prices[asin]] for asin in asin_arr if asin in rows]
+
+	# asins seen before in this run are dropped, cached asins skip SP-API, asins with only a stale price
+	# wait for a full pricing batch and the rest for a full catalog batch:
+	# returns (cached product info, catalog batches and pricing batches that are due now)
+	def split_cached(self, asin_arr, tag = None):
+		asin_arr = self.seen.first_seen('asin', asin_arr, tag)
+		hits, stale, misses = self.catalog_cache.lookup(asin_arr)
+		return [hits[asin] for asin in asin_arr if asin in hits], self.batcher.add(misses), self.price_batcher.add(stale)
+
+	# asins still waiting for a batch, kept in the checkpoint (on resume they all go to the catalog)
+	def pending_asins(self):
+		return list(self.batcher.pending) + list(self.price_batcher.pending)
+
+	# the partial batches left at the end of the input: (catalog batches, pricing batches)
+	def flush_batches(self):
+		return self.batcher.flush(), self.price_batcher.flush()
+
+	# drop products whose jan was already looked up in this run (e.g. a variant asin or another browse node)
+	def drop_seen_jans(self, product_list, tag = None):
+		fresh = []
+		for product in product_list:
+			if product[0] == '' or self.seen.first_seen('jan', [product[0]], tag):
+				fresh.append(product)
+		return fresh
@@ -0,0 +1,43 @@
+import logging
+import lxml.html
+import requests
+
+logger = logging.getLogger('asin_discovery')
+
+# browse pages look like a regular browser request
+HEADERS = {
+	"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36",
+	"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+	"Accept-Language": "ja-JP,ja;q=0.9,en;q=0.8",
+}
+
+S_ASIN_XPATH = "//*[contains(concat(' ', normalize-space(@class), ' '), ' s-asin ')]/@data-asin"
+
+# read asins of a sales rank page over plain HTTP
+class HttpAsinDiscovery:
+	def __init__(self, http):
+		self.http = http
+
+	# return the data-asin values, or None when the page has to be rendered by a browser
+	def fetch_asins(self, url):
+		try:
+			response = self.http.get(url, headers = HEADERS)
+		except requests.exceptions.RequestException as e:
+			logger.warning('Request error: %s', e)
+			return None
+
+		if response.status_code != 200:
+			return None
+		return self.parse_asins(response.content)
+
+	def parse_asins(self, content):
+		try:
+			page = lxml.html.fromstring(content)
+		except Exception:
+			return None
+
+		asin_arr = [str(asin) for asin in page.xpath(S_ASIN_XPATH) if asin]
+		if len(asin_arr) == 0:
+			# captcha / script-only pages carry no result items
+			return None
+		return asin_arr
@@ -0,0 +1,105 @@
+import argparse
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+
+import action
+
+from crawler import Crawler
+from sharded import ShardedCrawl
+
+EXIT_FINISHED = 0
+EXIT_FAILED = 1
+EXIT_STOPPED = 130
+
+logger = logging.getLogger('batch_runner')
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description = 'Amazon - BookOff crawl without the window')
+	parser.add_argument('--mode', choices = ['ranking', 'report', 'sharded'], default = 'ranking', help = 'sales rank pages, the merchant listings report, or sales rank pages split over processes')
+	parser.add_argument('--discovery', choices = ['selenium', 'http'], default = None, help = 'asin discovery backend for ranking mode')
+	parser.add_argument('--resume', action = 'store_true', help = 'continue from the last checkpoint')
+	parser.add_argument('--processes', type = int, default = None, help = 'worker processes in sharded mode (default: all cores)')
+	parser.add_argument('--pages', type = int, default = 400, help = 'sales rank pages per category in sharded mode')
+	parser.add_argument('--shard-pages', type = int, default = 50, help = 'pages per shard in sharded mode')
+	parser.add_argument('--log-interval', type = float, default = 10.0, help = 'seconds between progress lines')
+	parser.add_argument('--log-file', default = None, help = 'write the log here instead of stderr')
+	parser.add_argument('--verbose', action = 'store_true')
+	args = parser.parse_args(argv)
+	if args.log_interval <= 0:
+		parser.error('--log-interval must be greater than 0')
+	return args
+
+def log_progress(stats):
+	slowest = '%s %.0fms' % stats['slowest'] if stats.get('slowest') else '-'
+	logger.info(
+		'%d/%d processed=%d matched=%d skipped=%d errored=%d duplicates=%d rate=%.1f/s recent=%.1f/s slowest=%s',
+		stats['position'], stats['total'], stats['processed'], stats['matched'], stats['skipped'], stats['errored'], stats['duplicates'],
+		stats['rate'], stats['recent_rate'], slowest
+	)
+
+def main(argv = None):
+	args = parse_args(sys.argv[1:] if argv is None else argv)
+	logging.basicConfig(
+		filename = args.log_file,
+		level = logging.DEBUG if args.verbose else logging.INFO,
+		format = '%(asctime)s %(levelname)s %(message)s'
+	)
+
+	stop_event = threading.Event()
+	sharded_crawl = None
+
+	def handle_signal(signum, frame):
+		logger.info('signal %s received, finishing the pages in flight', signum)
+		stop_event.set()
+		if sharded_crawl is not None:
+			sharded_crawl.stop()
+
+	signal.signal(signal.SIGINT, handle_signal)
+	signal.signal(signal.SIGTERM, handle_signal)
+
+	if args.mode == 'sharded':
+		sharded_crawl = ShardedCrawl(args.processes, pages_per_category = args.pages, shard_pages = args.shard_pages, discovery_backend = args.discovery)
+		try:
+			totals = sharded_crawl.run()
+		except Exception:
+			logger.exception('crawl failed')
+			return EXIT_FAILED
+		logger.info('run %s: %d processed, %d matched, %d errors, %d duplicates in %d shards',
+			sharded_crawl.run_id, totals['processed'], totals['matched'], totals['errored'], totals['duplicates'], totals['shards'])
+		return EXIT_STOPPED if stop_event.is_set() else EXIT_FINISHED
+
+	handler = action.ActionManagement()
+	if args.discovery:
+		handler.discovery_backend = args.discovery
+
+	crawler = Crawler(
+		handler,
+		args.mode,
+		args.resume,
+		should_stop = stop_event.is_set,
+		refresh_rate = 1 / args.log_interval,
+		on_status = lambda status: logger.info('status: %s', status),
+		on_progress = log_progress,
+		on_error = lambda message: logger.warning('error: %s', message)
+	)
+
+	try:
+		finished = crawler.run()
+	except Exception:
+		logger.exception('crawl failed')
+		return EXIT_FAILED
+	finally:
+		handler.close()
+
+	if finished:
+		return EXIT_FINISHED
+	if crawler.failed:
+		return EXIT_FAILED
+	return EXIT_STOPPED
+
+if __name__ == '__main__':
+	multiprocessing.freeze_support()
+	sys.exit(main())
@@ -0,0 +1,51 @@
+import time
+
+# collect asins from any number of pages into full-size catalog/pricing batches
+class AsinBatcher:
+	def __init__(self, size = 20, max_wait = 60.0):
+		self.size = size
+		self.max_wait = max_wait
+		self.pending = []
+		self.oldest = None
+
+	def __len__(self):
+		return len(self.pending)
+
+	# add asins and return every batch that is ready to be sent
+	def add(self, asins):
+		if len(asins) > 0:
+			if len(self.pending) == 0:
+				self.oldest = time.monotonic()
+			self.pending.extend(asins)
+
+		batches = []
+		while len(self.pending) >= self.size:
+			batches.append(self.pending[:self.size])
+			del self.pending[:self.size]
+
+		if len(self.pending) == 0:
+			self.oldest = None
+		elif len(batches) > 0 and len(self.pending) <= len(asins):
+			# whatever is left came in with this call
+			self.oldest = time.monotonic()
+
+		if self.expired():
+			batches.extend(self.flush())
+		return batches
+
+	# the oldest pending asin has waited longer than max_wait
+	def expired(self):
+		return self.oldest is not None and time.monotonic() - self.oldest >= self.max_wait
+
+	# return the partial batch (end of stream or timeout)
+	def flush(self):
+		if len(self.pending) == 0:
+			return []
+		batch = self.pending
+		self.pending = []
+		self.oldest = None
+		return [batch]
+
+	def reset(self, asins = None):
+		self.pending = list(asins or [])
+		self.oldest = time.monotonic() if self.pending else None
@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from metrics import percentile
+from stub_server import FIXTURES, start_process
+
+# stage, calls, items, items/s, p50, p95, p99
+ROW_FORMAT = '{:<14} {:>7} {:>8} {:>10} {:>9} {:>9} {:>9}'
+
+# latencies of the calls of one stage and its wall time (calls may overlap)
+class Stage:
+	def __init__(self, name):
+		self.name = name
+		self.latencies = []
+		self.items = 0
+		self.wall = 0.0
+		self.lock = threading.Lock()
+
+	def __enter__(self):
+		self.started = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.wall += time.perf_counter() - self.started
+
+	def record(self, seconds, items = 1):
+		with self.lock:
+			self.latencies.append(seconds)
+			self.items += items
+
+	# call func and record its latency
+	def call(self, func, *args, items = 1):
+		started = time.perf_counter()
+		try:
+			return func(*args)
+		finally:
+			self.record(time.perf_counter() - started, items)
+
+	def result(self):
+		latencies = sorted(self.latencies)
+		return {
+			'calls': len(latencies),
+			'items': self.items,
+			'wall': round(self.wall, 4),
+			'items_per_s': round(self.items / self.wall, 1) if self.wall > 0 else 0.0,
+			'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+			'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+			'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+		}
+
+# config module pointing ActionManagement at the stub server, without rate limits
+def install_config(base_url, args):
+	config = types.ModuleType('config')
+	config.REFRESH_TOKEN = 'benchmark-refresh-token'
+	config.CLIENT_ID = 'benchmark-client'
+	config.CLIENT_SECRET = 'benchmark-secret'
+	config.MAKETPLACEID = 'A1VC38T7YXB528'
+	config.SELLERID = 'A2BENCHMARK'
+	config.SP_API_URL = base_url
+	config.LWA_TOKEN_URL = base_url + '/auth/o2/token'
+	config.AMAZON_URL = base_url
+	config.BOOKOFF_URL = base_url
+	config.SP_API_LIMITS = {operation: (1000, 1000) for operation in ['getReports', 'getReportDocument', 'searchCatalogItems', 'getCompetitivePricing', 'getItemOffersBatch']}
+	config.DISCOVERY_BACKEND = 'http'
+	# every host is the stub here, one pool has to take all the crawl's connections
+	config.HTTP_POOL_SIZES = {urlsplit(base_url).netloc: 32}
+	config.BOOKOFF_PARSER = args.parser
+	config.PRICING_SOURCE = args.pricing
+	config.PRICE_FETCH = args.price_fetch
+	sys.modules['config'] = config
+	return config
+
+def batches(items, size):
+	return [items[i:i + size] for i in range(0, len(items), size)]
+
+def bench_token(handler, stages, args):
+	with stages.setdefault('token', Stage('token')) as stage:
+		for _ in range(args.repeat * 10):
+			stage.call(handler.request_access_token)
+
+def bench_report(handler, stages, args):
+	with stages.setdefault('report', Stage('report')) as stage:
+		for _ in range(args.repeat):
+			handler.products_list = []
+			started = time.perf_counter()
+			result = handler.product_list_download_from_amazon()
+			stage.record(time.perf_counter() - started, result['total'])
+
+def bench_browse(handler, stages, args, category):
+	asin_arr = []
+	with stages.setdefault('browse', Stage('browse')) as stage:
+		for page_number in range(1, args.pages + 1):
+			url = handler.get_browse_url(category, page_number)
+			page = stage.call(handler.http_discovery.fetch_asins, url, items = 16)
+			asin_arr.extend(page or [])
+	return asin_arr
+
+def bench_sp_api(handler, stages, asin_arr):
+	handler.access_token = handler.get_access_token()
+	products = []
+	with stages.setdefault('pricing', Stage('pricing')) as stage:
+		for asin_batch in batches(asin_arr, handler.batch_size):
+			stage.call(handler.get_prices, asin_batch, items = len(asin_batch))
+	with stages.setdefault('catalog', Stage('catalog')) as stage:
+		for asin_batch in batches(asin_arr, handler.batch_size):
+			result = stage.call(handler.get_jan_code_by_asin, asin_batch, handler.convert_array_to_string(asin_batch), items = len(asin_batch))
+			products.extend(result or [])
+	return products
+
+def bench_bookoff(handler, stages, products, args):
+	pages = [filepath.read_bytes() for filepath in sorted((FIXTURES / 'bookoff').glob('*.html'))]
+	with stages.setdefault('parse', Stage('parse')) as stage:
+		for _ in range(args.repeat * 500):
+			for content in pages:
+				stage.call(handler.parse_bookoff_page, content)
+
+	# serial lookups show the latency of one fetch, the pool its throughput
+	serial = products[:len(products) // 4]
+	with stages.setdefault('bookoff', Stage('bookoff')) as stage:
+		for product in serial:
+			stage.call(handler.lookup_product, product)
+
+	# the crawl's own bookoff stage, BOOKOFF_WORKERS threads with BOOKOFF_MAX_IN_FLIGHT queued
+	from crawler import Crawler
+	from pipeline import Pipeline
+
+	stage = stages.setdefault('bookoff_pool', Stage('bookoff_pool'))
+	bookoff_stage = Crawler(handler).bookoff_stage()
+	lookup = bookoff_stage.func
+	bookoff_stage.func = lambda product: stage.call(lookup, product)
+	with stage:
+		for _ in Pipeline(iter(products[len(serial):]), [bookoff_stage]).results():
+			pass
+
+def bench_crawl(handler, stages, args, category):
+	from crawler import Crawler
+
+	handler.start_run()
+	crawler = Crawler(handler, refresh_rate = 10)
+	first_page = args.pages + 1
+	with stages.setdefault('crawl', Stage('crawl')) as stage:
+		started = time.perf_counter()
+		stats = crawler.run_pages(category, first_page, first_page + args.pages - 1)
+		stage.record(time.perf_counter() - started, stats['processed'])
+	handler.finish_run()
+
+def bench_sqlite(stages, args):
+	from history_writer import HistoryWriter
+
+	writer = HistoryWriter('benchmark.db', batch_size = 500)
+	writer.start('benchmark', reset = True)
+	row = ('4560109089380', 'https://shopping.bookoff.co.jp/used/0018549321', '', 3190, 4180, '')
+	position = 0
+	with stages.setdefault('sqlite', Stage('sqlite')) as stage:
+		for _ in range(args.rows // 500):
+			started = time.perf_counter()
+			for _ in range(500):
+				position += 1
+				writer.write((position,) + row)
+			writer.flush()
+			stage.record(time.perf_counter() - started, 500)
+	writer.stop()
+
+# the window's table and export, skipped when PyQt5 is not installed
+def bench_gui(stages, args):
+	os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+	try:
+		from PyQt5.QtWidgets import QApplication, QTableView
+		from exporter import ExportThread
+		from table_model import HistoryTableModel, ProductTableModel
+	except ImportError as e:
+		print(f"skipping draw_table and savefile: {e}")
+		return
+
+	app = QApplication.instance() or QApplication([])
+	view = QTableView()
+	model = ProductTableModel(view)
+	view.setModel(model)
+	view.show()
+	product = {
+		'jan': '4560109089380', 'url': 'https://shopping.bookoff.co.jp/used/0018549321', 'stock': '',
+		'site_price': '3190', 'amazon_price': '4180', 'price_status': ''
+	}
+	# the crawl hands over about ten products per refresh
+	with stages.setdefault('draw_table', Stage('draw_table')) as stage:
+		for _ in range(args.rows // 10):
+			started = time.perf_counter()
+			model.append_rows([product] * 10)
+			app.processEvents()
+			stage.record(time.perf_counter() - started, 10)
+	view.close()
+
+	# the history viewer scrolling through the rows bench_sqlite wrote, one page per fetch
+	history_model = HistoryTableModel('benchmark.db', page_size = 500)
+	with stages.setdefault('history_page', Stage('history_page')) as stage:
+		fetch = lambda: history_model.load('benchmark')
+		while True:
+			first = history_model.rowCount()
+			started = time.perf_counter()
+			fetch()
+			stage.record(time.perf_counter() - started, history_model.rowCount() - first)
+			if not history_model.canFetchMore():
+				break
+			fetch = history_model.fetchMore
+	history_model.close()
+
+	for extension in ['csv', 'xlsx']:
+		messages = []
+		export_thread = ExportThread(f'benchmark.{extension}', db_path = 'benchmark.db')
+		export_thread.export_finished.connect(messages.append)
+		with stages.setdefault('savefile_' + extension, Stage('savefile_' + extension)) as stage:
+			stage.call(export_thread.run, items = args.rows // 500 * 500)
+		if messages and messages[-1] != "出力が完了しました。":
+			print(messages[-1])
+
+def run_benchmark(args):
+	stages = {}
+	server, base_url = start_process(args.latency)
+	workdir = os.getcwd()
+	with tempfile.TemporaryDirectory(prefix = 'bookoff-bench-') as folder:
+		# database.db and the exported files stay in the temporary folder
+		os.chdir(folder)
+		try:
+			install_config(base_url, args)
+			import action
+
+			handler = action.ActionManagement()
+			try:
+				category = '561956'
+				bench_token(handler, stages, args)
+				bench_report(handler, stages, args)
+				asin_arr = bench_browse(handler, stages, args, category)
+				products = bench_sp_api(handler, stages, asin_arr)
+				bench_bookoff(handler, stages, products, args)
+				bench_crawl(handler, stages, args, category)
+			finally:
+				handler.close()
+			bench_sqlite(stages, args)
+			bench_gui(stages, args)
+		finally:
+			os.chdir(workdir)
+			server.terminate()
+			server.join()
+
+	return {
+		'settings': {'pages': args.pages, 'rows': args.rows, 'repeat': args.repeat, 'latency': args.latency, 'parser': args.parser,
+			'pricing': args.pricing, 'price_fetch': args.price_fetch},
+		'stages': {name: stage.result() for name, stage in stages.items()},
+	}
+
+def print_results(results):
+	print(ROW_FORMAT.format('stage', 'calls', 'items', 'items/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+	for name, result in results['stages'].items():
+		print(ROW_FORMAT.format(
+			name, result['calls'], result['items'], result['items_per_s'],
+			result['p50_ms'], result['p95_ms'], result['p99_ms']
+		))
+
+# stages whose throughput dropped by more than tolerance against the baseline
+def compare(results, baseline, tolerance):
+	regressions = []
+	for name, result in results['stages'].items():
+		before = baseline['stages'].get(name)
+		if before is None or before['items_per_s'] <= 0:
+			continue
+		change = result['items_per_s'] / before['items_per_s'] - 1
+		if change < -tolerance:
+			regressions.append(f"{name}: {before['items_per_s']} -> {result['items_per_s']} items/s ({change:+.0%})")
+	return regressions
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description = 'offline throughput benchmark against recorded fixtures')
+	parser.add_argument('--pages', type = int, default = 20, help = 'sales rank pages (16 products each) per stage')
+	parser.add_argument('--rows', type = int, default = 20000, help = 'rows for the sqlite, draw_table and savefile stages')
+	parser.add_argument('--repeat', type = int, default = 3, help = 'repetitions of the token, report and parse stages')
+	parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds the stub server waits before each response')
+	parser.add_argument('--parser', choices = ['fast', 'soup'], default = 'fast', help = 'bookoff page parser')
+	parser.add_argument('--pricing', choices = ['competitive', 'offers'], default = 'competitive', help = 'pricing endpoint')
+	parser.add_argument('--price-fetch', choices = ['concurrent', 'missing'], default = 'concurrent', help = 'price every item alongside the catalog call, or only items without list_price after it')
+	parser.add_argument('--save', default = None, help = 'write the results as json')
+	parser.add_argument('--baseline', default = None, help = 'fail when a stage is slower than in this saved result')
+	parser.add_argument('--tolerance', type = float, default = 0.25, help = 'allowed throughput drop against the baseline')
+	return parser.parse_args(argv)
+
+def main(argv = None):
+	args = parse_args(sys.argv[1:] if argv is None else argv)
+	results = run_benchmark(args)
+	print_results(results)
+
+	if args.save:
+		Path(args.save).write_text(json.dumps(results, indent = 2), encoding = 'utf-8')
+
+	if args.baseline:
+		baseline = json.loads(Path(args.baseline).read_text(encoding = 'utf-8'))
+		regressions = compare(results, baseline, args.tolerance)
+		for regression in regressions:
+			print(f"regression: {regression}")
+		return 1 if regressions else 0
+	return 0
+
+# replay the fixtures offline: python benchmark.py [--latency 0.05] [--save result.json] [--baseline result.json]
+if __name__ == '__main__':
+	sys.exit(main())
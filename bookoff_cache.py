@@ -0,0 +1,61 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('bookoff_cache')
+
+# BookOff search result per JAN in database.db, including JANs BookOff does not carry
+class BookOffCache:
+	def __init__(self, db_path = 'database.db', ttl = 24 * 3600, negative_ttl = 7 * 24 * 3600):
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.lock = threading.Lock()
+		self.conn = sqlite3.connect(db_path, timeout = 60, check_same_thread = False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS bookoff_cache ("
+						"jan text PRIMARY KEY, found integer, url text, price integer, stock text, "
+						"etag text, last_modified text, checked_at real)")
+		self.conn.commit()
+
+	# return (item, etag, last_modified, fresh) or None; item is None for a negative entry
+	def get(self, jan):
+		with self.lock:
+			row = self.conn.execute(
+				"SELECT found, url, price, stock, etag, last_modified, checked_at FROM bookoff_cache WHERE jan = ?",
+				(jan,)
+			).fetchone()
+		if row is None:
+			return None
+
+		found, url, price, stock, etag, last_modified, checked_at = row
+		item = {'url': url, 'price': price, 'stock': stock} if found else None
+		ttl = self.ttl if found else self.negative_ttl
+		fresh = time.time() - checked_at < ttl
+		return item, etag, last_modified, fresh
+
+	def put(self, jan, item, etag = None, last_modified = None):
+		if item:
+			values = (jan, 1, item['url'], item['price'], item['stock'], etag, last_modified, time.time())
+		else:
+			values = (jan, 0, None, None, None, etag, last_modified, time.time())
+		with self.lock:
+			try:
+				with self.conn:
+					self.conn.execute("INSERT OR REPLACE INTO bookoff_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values)
+			except sqlite3.Error as e:
+				logger.error('SQLite error: %s', e)
+
+	# the site confirmed the entry is unchanged (304)
+	def touch(self, jan):
+		with self.lock:
+			try:
+				with self.conn:
+					self.conn.execute("UPDATE bookoff_cache SET checked_at = ? WHERE jan = ?", (time.time(), jan))
+			except sqlite3.Error as e:
+				logger.error('SQLite error: %s', e)
+
+	def close(self):
+		with self.lock:
+			self.conn.close()
@@ -0,0 +1,103 @@
+import html
+import re
+
+import lxml.html
+
+BASE_URL = "https://shopping.bookoff.co.jp"
+
+# the tags we need, matched on the class token like BeautifulSoup's class_ does
+ITEM_RE = re.compile(rb'class\s*=\s*["\'](?:[^"\']*\s)?productItem(?:\s[^"\']*)?["\']')
+LINK_RE = re.compile(rb'class\s*=\s*["\'](?:[^"\']*\s)?productItem__link(?:\s[^"\']*)?["\']')
+PRICE_RE = re.compile(rb'class\s*=\s*["\'](?:[^"\']*\s)?productItem__price(?:\s[^"\']*)?["\']')
+ALERT_RE = re.compile(rb'class\s*=\s*["\'](?:[^"\']*\s)?productItem__stock--alert(?:\s[^"\']*)?["\']')
+HREF_RE = re.compile(rb'\shref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))')
+
+# spans html.parser does not read as markup: comments, and script/style contents
+HIDDEN_RE = re.compile(rb'<!--|<(script|style)\b', re.I)
+HIDDEN_END_RE = {
+	b'script': re.compile(rb'</script\s*>', re.I),
+	b'style': re.compile(rb'</style\s*>', re.I),
+}
+
+# a price element is small, only parse this much of it
+PRICE_WINDOW = 2048
+
+# start and end of the tag whose attribute matched
+def tag_bounds(content, match):
+	start = content.rfind(b'<', 0, match.start())
+	end = content.find(b'>', match.end())
+	return start, end + 1
+
+# first match of pattern in content[pos:endpos] that is not inside a hidden span
+def search_markup(pattern, content, pos = 0, endpos = None):
+	if endpos is None:
+		endpos = len(content)
+	while True:
+		match = pattern.search(content, pos, endpos)
+		if match is None:
+			return None
+		hidden = HIDDEN_RE.search(content, pos, match.start())
+		if hidden is None:
+			return match
+		if hidden.group(1) is None:
+			close = content.find(b'-->', hidden.end())
+			pos = len(content) if close < 0 else close + 3
+		else:
+			close = HIDDEN_END_RE[hidden.group(1).lower()].search(content, hidden.end())
+			pos = len(content) if close is None else close.end()
+
+# the first search result: from its productItem tag up to the next one (the whole page when there is none)
+def first_item_bounds(content):
+	item = search_markup(ITEM_RE, content)
+	if item is None:
+		return 0, len(content)
+	start, end = tag_bounds(content, item)
+	next_item = search_markup(ITEM_RE, content, end)
+	return start, len(content) if next_item is None else next_item.start()
+
+# parse the first search result of a bookoff page, None when nothing was found
+def parse_bookoff_page(content):
+	item_start, item_end = first_item_bounds(content)
+	link_match = search_markup(LINK_RE, content, item_start, item_end)
+	if link_match is None:
+		return None
+
+	start, end = tag_bounds(content, link_match)
+	href_match = HREF_RE.search(content, start, end)
+	href = ''
+	if href_match:
+		href = html.unescape(next(group for group in href_match.groups() if group is not None).decode('utf-8', 'replace'))
+	product_url = BASE_URL + href
+
+	price_match = search_markup(PRICE_RE, content, item_start, item_end)
+	start, end = tag_bounds(content, price_match)
+	price_element = lxml.html.fragment_fromstring(
+		content[start:start + PRICE_WINDOW].decode('utf-8', 'replace'),
+		create_parent = 'div'
+	)[0].text_content()
+	price_element = price_element.replace(',', '')
+	price = int(re.findall(r'\d+', price_element)[0])
+
+	stock = '在庫なし' if search_markup(ALERT_RE, content, item_start, item_end) else ''
+	return {'url': product_url, 'price': price, 'stock': stock}
+
+# reference implementation: full BeautifulSoup parse of the page, read from its first productItem
+def parse_bookoff_page_soup(content):
+	from bs4 import BeautifulSoup
+
+	page = BeautifulSoup(content, "html.parser")
+	item = page.find(class_='productItem') or page
+	
+	product_url = item.find(class_='productItem__link')
+	
+	if product_url:
+		product_url = BASE_URL + product_url.get('href')
+	else:
+		return None
+	
+	price_element = item.find(class_='productItem__price').text
+	stock_element = item.find_all(class_="productItem__stock--alert")
+	price_element = price_element.replace(',', '')
+	price = int(re.findall(r'\d+', price_element)[0])
+	stock = '在庫なし' if stock_element else ''
+	return {'url': product_url, 'price': price, 'stock': stock}
@@ -0,0 +1,113 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('catalog_cache')
+
+# seconds each field stays fresh; None never expires
+DEFAULT_TTL = {
+	'jan': None,
+	'category': 30 * 24 * 3600,
+	'rank': 24 * 3600,
+	'price': 6 * 3600,
+}
+
+FIELDS = ['jan', 'category', 'rank', 'price']
+
+# persistent asin -> (jan, category, rank, list price) cache in database.db;
+# price_from tells whether the price was the catalog's list price or came from the pricing API
+class CatalogCache:
+	def __init__(self, db_path = 'database.db', ttl = None):
+		self.ttl = dict(DEFAULT_TTL)
+		self.ttl.update(ttl or {})
+		self.lock = threading.Lock()
+		self.conn = sqlite3.connect(db_path, timeout = 60, check_same_thread = False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS asin_cache ("
+						"asin text PRIMARY KEY, "
+						"jan text, jan_at real, "
+						"category text, category_at real, "
+						"rank integer, rank_at real, "
+						"price real, price_at real, price_from text)")
+		columns = [row[1] for row in self.conn.execute("PRAGMA table_info(asin_cache)")]
+		if 'price_from' not in columns:
+			try:
+				self.conn.execute("ALTER TABLE asin_cache ADD COLUMN price_from text")
+			except sqlite3.OperationalError:
+				# another process added it first
+				pass
+		self.conn.commit()
+
+	def is_fresh(self, field, fetched_at, now):
+		if fetched_at is None:
+			return False
+		ttl = self.ttl.get(field)
+		return ttl is None or now - fetched_at < ttl
+
+	def select(self, asins):
+		placeholders = ','.join('?' * len(asins))
+		with self.lock:
+			return self.conn.execute(
+				"SELECT asin, jan, jan_at, category, category_at, rank, rank_at, price, price_at, price_from "
+				f"FROM asin_cache WHERE asin IN ({placeholders})",
+				list(asins)
+			).fetchall()
+
+	# split asins into fresh cached rows ({asin: [jan, category, rank, price]}), asins of which only a price
+	# from the pricing API went stale (a pricing call refreshes them) and misses that need the catalog
+	def lookup(self, asins):
+		hits = {}
+		stale_prices = set()
+		if len(asins) > 0:
+			now = time.time()
+			for row in self.select(asins):
+				fresh = [self.is_fresh(field, row[2 + 2 * i], now) for i, field in enumerate(FIELDS)]
+				if all(fresh):
+					hits[row[0]] = list(row[1:9:2])
+				elif all(fresh[:3]) and row[9] == 'pricing':
+					stale_prices.add(row[0])
+
+		stale = [asin for asin in asins if asin in stale_prices]
+		misses = [asin for asin in asins if asin not in hits and asin not in stale_prices]
+		return hits, stale, misses
+
+	# cached rows whatever their age, {asin: [jan, category, rank, price]}
+	def get_many(self, asins):
+		if len(asins) == 0:
+			return {}
+		return {row[0]: list(row[1:9:2]) for row in self.select(asins)}
+
+	# store fetched rows, keyed by asin; priced: the asins whose price came from the pricing API
+	def put_many(self, products, priced = ()):
+		if len(products) == 0:
+			return
+		now = time.time()
+		rows = [
+			(asin, product[0], now, product[1], now, product[2], now, product[3], now, 'pricing' if asin in priced else 'catalog')
+			for asin, product in products.items()
+		]
+		with self.lock:
+			try:
+				with self.conn:
+					self.conn.executemany("INSERT OR REPLACE INTO asin_cache (asin, jan, jan_at, category, category_at, rank, rank_at, "
+										"price, price_at, price_from) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+			except sqlite3.Error as e:
+				logger.error('SQLite error: %s', e)
+
+	# store refreshed prices from the pricing API, {asin: price}
+	def put_prices(self, prices):
+		if len(prices) == 0:
+			return
+		now = time.time()
+		with self.lock:
+			try:
+				with self.conn:
+					self.conn.executemany("UPDATE asin_cache SET price = ?, price_at = ?, price_from = 'pricing' WHERE asin = ?",
+										[(price, now, asin) for asin, price in prices.items()])
+			except sqlite3.Error as e:
+				logger.error('SQLite error: %s', e)
+
+	def close(self):
+		with self.lock:
+			self.conn.close()
@@ -0,0 +1,54 @@
+import time
+
+from collections import deque
+
+# counters of a crawl run
+class CrawlStats:
+	def __init__(self, total = 0, rate_window = 30.0):
+		self.total = total
+		self.position = 0
+		self.processed = 0
+		self.matched = 0
+		self.skipped = 0
+		self.errored = 0
+		self.duplicates = 0  # asins and jans already handled earlier in the run
+		self.started = time.monotonic()
+		self.rate_window = rate_window
+		self.samples = deque([(self.started, 0)])  # (time, processed)
+
+	# products per second over the last rate_window seconds
+	def recent_rate(self, now):
+		self.samples.append((now, self.processed))
+		while len(self.samples) > 2 and now - self.samples[1][0] >= self.rate_window:
+			self.samples.popleft()
+		then, processed = self.samples[0]
+		return (self.processed - processed) / (now - then) if now > then else 0.0
+
+	def snapshot(self):
+		now = time.monotonic()
+		elapsed = now - self.started
+		return {
+			'total': self.total,
+			'position': self.position,
+			'processed': self.processed,
+			'matched': self.matched,
+			'skipped': self.skipped,
+			'errored': self.errored,
+			'duplicates': self.duplicates,
+			'elapsed': elapsed,
+			'rate': self.processed / elapsed if elapsed > 0 else 0.0,
+			'recent_rate': self.recent_rate(now),
+		}
+
+# lets through at most one update per interval
+class Throttle:
+	def __init__(self, interval = 0.1):
+		self.interval = interval
+		self.last = 0.0
+
+	def due(self, force = False):
+		now = time.monotonic()
+		if force or now - self.last >= self.interval:
+			self.last = now
+			return True
+		return False
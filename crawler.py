@@ -0,0 +1,258 @@
+import time
+
+from crawl_stats import CrawlStats, Throttle
+from metrics import write_metrics_file
+from pipeline import Marker, Pipeline, Stage, StageError
+
+# end of a sales rank page or report batch in the results, where a checkpoint can go
+# (tag: the seen set tag of the asins and jans the page brought in)
+class PageDone(Marker):
+	def __init__(self, page = None, pending = None, position = None, tag = None, category = None):
+		self.page = page
+		self.category = category
+		self.pending = pending
+		self.position = position
+		self.tag = tag
+
+# the crawl loop, shared by the window and the batch runner
+class Crawler:
+	def __init__(self, handler, mode = 'ranking', resume = False, should_stop = None, refresh_rate = 10,
+				on_status = None, on_progress = None, on_error = None, on_products = None):
+		self.handler = handler
+		self.mode = mode  # 'ranking' or 'report'
+		self.resume = resume
+		self.should_stop = should_stop or (lambda: False)
+		self.on_status = on_status or (lambda status: None)
+		self.on_progress = on_progress or (lambda stats: None)
+		self.on_error = on_error or (lambda message: None)
+		self.on_products = on_products or (lambda products: None)
+		self.total_count = 350000
+		self.stats = CrawlStats(self.total_count)
+		self.throttle = Throttle(1 / refresh_rate)
+		self.metrics_throttle = Throttle(handler.metrics_interval)
+		self.pending_found = []
+		self.last_error = ''
+		self.failed = False
+		self.stopped = False
+		self.position = 0
+		self.last_row = 0  # row id of the last product, see process_result
+
+	# returns True when the run went through to the end; an unexpected error fails the run
+	# but the run is still closed and "stop" still sent
+	def run(self):
+		self.on_status("start")
+		finished = False
+		try:
+			checkpoint = self.handler.load_checkpoint() if self.resume else None
+			if checkpoint:
+				self.mode = checkpoint['mode']
+			self.handler.start_run(checkpoint, self.mode)
+			self.last_row = self.handler.last_row
+
+			if self.mode == 'report':
+				finished = self.run_report(checkpoint)
+			else:
+				finished = self.run_ranking(checkpoint)
+
+			if finished:
+				self.handler.clear_checkpoint()
+		except Exception as e:
+			finished = False
+			self.failed = True
+			self.on_error(str(e) or type(e).__name__)
+		finally:
+			try:
+				self.handler.finish_run('finished' if finished else 'failed' if self.failed else 'stopped')
+				self.report_progress(force = True)
+			finally:
+				self.on_status("stop")
+		return finished
+
+	# walk the amazon sales rank pages
+	def run_ranking(self, checkpoint = None):
+		self.position = checkpoint['position'] if checkpoint else 0
+		# pending asins stay in the checkpoint when stopped, so only flush at the end
+		self.consume(self.page_pipeline(self.iter_ranking_pages(), flush = lambda: not self.stopped), mode = 'ranking')
+		return not self.stopped
+
+	# sales rank pages from the current position on; the category follows the position the
+	# results have reached, which trails the pages in flight by the length of the pipeline,
+	# so a resumed crawl goes on from the category of the checkpointed page, not of its position
+	def iter_ranking_pages(self):
+		category = self.handler.cur_category or self.handler.get_category(self.position + 1)
+		page_number = self.handler.cur_page
+		while self.position < self.total_count:
+			if self.should_stop():
+				self.stopped = True
+				return
+			if self.handler.get_category(self.position + 1) != category:
+				category = self.handler.get_category(self.position + 1)
+				page_number = 0
+			page_number += 1
+			yield category, page_number
+
+	# walk a page range of one sales rank category (one shard of a sharded crawl)
+	def run_pages(self, category, first_page, last_page):
+		self.position = 0
+		self.last_row = 0
+		pages = self.until_stopped((category, page_number) for page_number in range(first_page, last_page + 1))
+		self.consume(self.page_pipeline(pages, flush = lambda: True))
+		self.report_progress(force = True)
+		return self.stats.snapshot()
+
+	# walk the listings of the merchant listings report
+	def run_report(self, checkpoint = None):
+		offset = checkpoint['position'] if checkpoint else 0
+		report_document_id = checkpoint['report_document_id'] if checkpoint else ''
+		result = self.handler.product_list_download_from_amazon(report_document_id)
+		if(type(result) == str):
+			self.failed = True
+			self.on_error(result)
+			return False
+
+		self.total_count = result['total']
+		self.stats.total = self.total_count
+		self.on_status("reading")
+
+		self.position = offset
+		batches = self.until_stopped(
+			(asin_arr, {'position': position + len(asin_arr)})
+			for position, asin_arr in self.handler.iter_product_batches(offset, self.handler.batch_size)
+		)
+		# pending asins stay in the checkpoint when stopped, so only flush at the end
+		pipeline = Pipeline(batches, self.product_stages(flush = lambda: not self.stopped))
+		self.consume(pipeline, mode = 'report', report_document_id = result['filepath'])
+		return not self.stopped
+
+	def until_stopped(self, items):
+		for item in items:
+			if self.should_stop():
+				self.stopped = True
+				return
+			yield item
+
+	# pages -> asins, then the product stages
+	def page_pipeline(self, pages, flush):
+		handler = self.handler
+
+		# a page that failed to load still ends, so the checkpoint moves past it
+		def discover(page):
+			category, page_number = page
+			done = {'page': page_number, 'category': category}
+			try:
+				return [(handler.fetch_asins(handler.get_browse_url(category, page_number)) or [], done)]
+			except Exception as e:
+				return [StageError(e), ([], done)]
+
+		return Pipeline(pages, [Stage('discover', discover, workers = handler.page_prefetch)] + self.product_stages(flush))
+
+	# (asins, PageDone fields) -> cached product info and due catalog/pricing batches -> product info -> bookoff lookups
+	def product_stages(self, flush):
+		handler = self.handler
+		tags = [0]
+
+		# one thread, the batchers collect asins across pages
+		def batch(item):
+			asin_arr, done = item
+			tags[0] += 1
+			product_list, batches, price_batches = handler.split_cached(asin_arr, tags[0])
+			return [(tags[0], product_list, batches, price_batches), PageDone(pending = handler.pending_asins(), tag = tags[0], **done)]
+
+		def flush_batches():
+			return [(tags[0] + 1, [], *handler.flush_batches())] if flush() else []
+
+		# a failed batch is counted as an error, the cached products of the page still go on
+		def catalog(work):
+			tag, product_list, batches, price_batches = work
+			try:
+				fetched = handler.get_product_info_by_batches(batches, price_batches)
+			except Exception as e:
+				return [StageError(e)] + handler.drop_seen_jans(product_list, tag)
+			return handler.drop_seen_jans(product_list + fetched, tag)
+
+		return [
+			Stage('batch', batch, finish = flush_batches),
+			Stage('catalog', catalog, workers = handler.catalog_workers),
+			self.bookoff_stage(),
+		]
+
+	def bookoff_stage(self):
+		lookup = lambda product: [(product, self.handler.lookup_product(product))]
+		return Stage('bookoff', lookup, workers = self.handler.bookoff_workers, queue_size = self.handler.bookoff_in_flight)
+
+	# take the results in order: keep the matches, count, and checkpoint where a page ends
+	def consume(self, pipeline, mode = None, report_document_id = ''):
+		for item in pipeline.results():
+			try:
+				if isinstance(item, StageError):
+					self.record_error(item.error)
+				elif isinstance(item, PageDone):
+					self.position = self.position + 1 if item.position is None else max(self.position, item.position)
+					seen = self.handler.seen.commit(item.tag) if item.tag is not None else []
+					if mode:
+						self.handler.save_checkpoint(mode, self.position, report_document_id, page = item.page, category = item.category,
+													pending = item.pending, seen = seen, last_row = self.last_row)
+					self.stats.position = min(self.position, self.total_count)
+					self.report_progress()
+				else:
+					self.process_result(*item)
+			except Exception as e:
+				self.record_error(e)
+
+	# bookoff lookup result of one product; its row id only ever grows: the sales rank position in
+	# ranking mode, a count of its own in report mode, where the listing offset the checkpoints
+	# resume from trails the products the batcher has already released
+	def process_result(self, product, result):
+		product_data, error = result
+		if self.mode == 'report':
+			self.last_row += 1
+		else:
+			self.position += 1
+			self.last_row = self.position
+		self.stats.processed += 1
+		if error:
+			self.record_error(error)
+		elif product_data:
+			self.stats.matched += 1
+			self.handler.save_product(product_data, self.last_row)
+			self.pending_found.append(product_data)
+		else:
+			self.stats.skipped += 1
+
+		self.stats.position = min(self.position, self.total_count)
+		self.report_progress()
+
+	def record_error(self, error):
+		self.stats.errored += 1
+		self.last_error = str(error)
+		self.report_progress()
+
+	# send counters, new rows and the latest error at most UI_REFRESH_RATE times a second
+	def report_progress(self, force = False):
+		if not self.throttle.due(force):
+			return
+		if self.pending_found:
+			self.on_products(self.pending_found)
+			self.pending_found = []
+		if self.last_error:
+			self.on_error(self.last_error)
+			self.last_error = ''
+		self.stats.duplicates = self.handler.seen.skipped
+		stats = self.stats.snapshot()
+		stats['slowest'] = self.handler.metrics.slowest()
+		self.on_progress(stats)
+		self.write_metrics(stats, force)
+
+	# machine readable counters and stage timings for monitoring, every METRICS_INTERVAL seconds
+	def write_metrics(self, stats, force = False):
+		if not self.handler.metrics_file or not self.metrics_throttle.due(force):
+			return
+		write_metrics_file(self.handler.metrics_file, {
+			'updated': time.time(),
+			'run_id': self.handler.run_id,
+			'mode': self.mode,
+			'crawl': stats,
+			'stages': self.handler.metrics.snapshot(),
+			'sp_api': self.handler.sp_api.stats(),
+			'http': self.handler.http.stats(),
+		})
@@ -0,0 +1,114 @@
+import queue
+import subprocess
+import threading
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+# long-lived headless Chrome drivers, recycled after max_pages or on crash
+class ChromeDriverPool:
+	def __init__(self, size = 2, max_pages = 50, wait_timeout = 10):
+		self.size = size
+		self.max_pages = max_pages
+		self.wait_timeout = wait_timeout
+		self.idle = queue.Queue()
+		self.lock = threading.Lock()
+		self.created = 0
+		self.drivers = set()  # idle and checked out, so close() reaches all of them
+		self.closed = False
+
+	def create_driver(self):
+		chrome_options = Options()
+		chrome_options.add_argument("--headless=new")
+		chrome_options.add_argument("--disable-gpu")
+		chrome_options.add_argument("--no-sandbox")
+		chrome_options.add_argument("--window-size=0,0")
+		# keeps chromedriver from opening a console window on Windows
+		if hasattr(subprocess, 'CREATE_NO_WINDOW'):
+			chrome_options.creationflags = subprocess.CREATE_NO_WINDOW
+		return webdriver.Chrome(options = chrome_options)
+
+	# take an idle driver, starting a new one while under size
+	def acquire(self):
+		while True:
+			try:
+				return self.idle.get_nowait()
+			except queue.Empty:
+				pass
+
+			with self.lock:
+				can_create = self.created < self.size
+				if can_create:
+					self.created += 1
+			if can_create:
+				try:
+					driver = self.create_driver()
+				except Exception:
+					with self.lock:
+						self.created -= 1
+					raise
+				with self.lock:
+					self.drivers.add(driver)
+				return driver, 0
+
+			try:
+				return self.idle.get(timeout = 0.5)
+			except queue.Empty:
+				continue
+
+	def release(self, driver, pages, broken = False):
+		if broken or pages >= self.max_pages or self.closed:
+			self.discard(driver)
+		else:
+			self.idle.put((driver, pages))
+
+	def discard(self, driver):
+		with self.lock:
+			if driver not in self.drivers:
+				return
+			self.drivers.discard(driver)
+			self.created -= 1
+		try:
+			driver.quit()
+		except Exception:
+			pass
+
+	# load a browse page and return the data-asin values of its s-asin elements;
+	# any error may mean chromedriver died (often MaxRetryError or ConnectionRefusedError), so the driver goes
+	def fetch_asins(self, url):
+		driver, pages = self.acquire()
+		try:
+			driver.get(url)
+			try:
+				WebDriverWait(driver, self.wait_timeout).until(
+					EC.presence_of_all_elements_located((By.CLASS_NAME, 's-asin'))
+				)
+			except TimeoutException:
+				pass
+
+			asin_arr = []
+			for product_element in driver.find_elements(By.CLASS_NAME, 's-asin'):
+				asin_arr.append(product_element.get_attribute('data-asin'))
+		except Exception:
+			self.release(driver, pages, broken = True)
+			raise
+
+		self.release(driver, pages + 1)
+		return asin_arr
+
+	# quit every driver, including those still loading a page; they are not handed out again
+	def close(self):
+		self.closed = True
+		while True:
+			try:
+				self.idle.get_nowait()
+			except queue.Empty:
+				break
+		with self.lock:
+			drivers = list(self.drivers)
+		for driver in drivers:
+			self.discard(driver)
@@ -0,0 +1,97 @@
+import csv
+import sqlite3
+
+import xlsxwriter
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+COLUMNS = ['jan', 'url', 'stock', 'site_price', 'amazon_price', 'price_status']
+HEADER_LABELS = ["JAN", "URL", "在庫", "サイト価格", "Amazonの価格", "価格差"]
+
+# rows per sheet, .xlsx allows 1,048,576 including the header
+XLSX_SHEET_ROWS = 1000000
+
+# stream the history rows of one run (the latest by default) into a .csv or .xlsx file in the background
+class ExportThread(QThread):
+	export_progress = pyqtSignal(int, int)
+	export_finished = pyqtSignal(str)
+
+	def __init__(self, filename, only_matched = False, run_id = None, db_path = 'database.db', chunk_size = 5000):
+		super().__init__()
+		self.filename = filename
+		self.only_matched = only_matched
+		self.run_id = run_id
+		self.db_path = db_path
+		self.chunk_size = chunk_size
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+	def query(self):
+		where = " WHERE run_id = ?"
+		if self.only_matched:
+			where += " AND price_status = 'T'"
+		return f"SELECT {', '.join(COLUMNS)} FROM history{where} ORDER BY row_id", f"SELECT COUNT(*) FROM history{where}"
+
+	def iter_chunks(self, conn):
+		run_id = self.run_id
+		if run_id is None:
+			row = conn.execute("SELECT run_id FROM runs ORDER BY started_at DESC LIMIT 1").fetchone()
+			run_id = row[0] if row else ''
+		select_sql, count_sql = self.query()
+		total = conn.execute(count_sql, (run_id,)).fetchone()[0]
+		cursor = conn.execute(select_sql, (run_id,))
+		done = 0
+		while not self.cancelled:
+			rows = cursor.fetchmany(self.chunk_size)
+			if len(rows) == 0:
+				break
+			yield rows
+			done += len(rows)
+			self.export_progress.emit(done, total)
+
+	def write_csv(self, conn):
+		with open(self.filename, 'w', newline = '', encoding = 'utf-8-sig') as file:
+			writer = csv.writer(file)
+			writer.writerow(HEADER_LABELS)
+			for rows in self.iter_chunks(conn):
+				writer.writerows(rows)
+
+	def write_xlsx(self, conn):
+		workbook = xlsxwriter.Workbook(self.filename, {'constant_memory': True})
+		header_format = workbook.add_format({'bold': True})
+		sheet = None
+		row_index = XLSX_SHEET_ROWS
+		try:
+			for rows in self.iter_chunks(conn):
+				for row in rows:
+					if row_index >= XLSX_SHEET_ROWS:
+						sheet = workbook.add_worksheet()
+						sheet.write_row(0, 0, HEADER_LABELS, header_format)
+						row_index = 0
+					row_index += 1
+					sheet.write_row(row_index, 0, row)
+			if sheet is None:
+				workbook.add_worksheet().write_row(0, 0, HEADER_LABELS, header_format)
+		finally:
+			workbook.close()
+
+	def run(self):
+		try:
+			conn = sqlite3.connect(self.db_path)
+			try:
+				if self.filename.lower().endswith('.csv'):
+					self.write_csv(conn)
+				else:
+					self.write_xlsx(conn)
+			finally:
+				conn.close()
+		except (sqlite3.Error, OSError, xlsxwriter.exceptions.XlsxWriterException) as e:
+			self.export_finished.emit(f"出力に失敗しました: {e}")
+			return
+
+		if self.cancelled:
+			self.export_finished.emit("出力を中止しました。")
+		else:
+			self.export_finished.emit("出力が完了しました。")
@@ -0,0 +1,128 @@
+import logging
+import sqlite3
+import time
+import webbrowser
+
+from exporter import ExportThread
+from table_model import HistoryTableModel
+from PyQt5 import QtWidgets, QtGui
+from PyQt5.QtWidgets import QFileDialog
+
+logger = logging.getLogger('history_dialog')
+
+STATUS_LABELS = {'running': '実行中', 'finished': '完了', 'stopped': '中断', 'failed': '失敗', 'imported': '旧履歴'}
+
+# past runs from the runs table; the rows of the chosen run load page by page while scrolling
+class HistoryDialog(QtWidgets.QDialog):
+	def __init__(self, parent = None, db_path = 'database.db', page_size = 500):
+		super().__init__(parent)
+		self.db_path = db_path
+		self.runs = {}
+		self.export_thread = None
+		self.setWindowTitle("履歴")
+		self.resize(900, 600)
+
+		self.verticalLayout = QtWidgets.QVBoxLayout(self)
+		self.horizontalLayout = QtWidgets.QHBoxLayout()
+		self.cmb_run = QtWidgets.QComboBox(self)
+		self.cmb_run.setObjectName("cmb_run")
+		self.cmb_run.currentIndexChanged.connect(self.show_run)
+		self.horizontalLayout.addWidget(self.cmb_run, 1)
+
+		self.chk_matched = QtWidgets.QCheckBox(self)
+		self.chk_matched.setObjectName("chk_matched")
+		self.chk_matched.setText("価格差ありのみ")
+		self.chk_matched.toggled.connect(self.show_run)
+		self.horizontalLayout.addWidget(self.chk_matched)
+
+		self.btn_export = QtWidgets.QPushButton(self)
+		self.btn_export.setObjectName("btn_export")
+		self.btn_export.setText("出力")
+		self.btn_export.clicked.connect(self.savefile)
+		self.horizontalLayout.addWidget(self.btn_export)
+		self.verticalLayout.addLayout(self.horizontalLayout)
+
+		self.tbl_history = QtWidgets.QTableView(self)
+		self.tbl_history.setObjectName("tbl_history")
+		self.tbl_history.doubleClicked.connect(self.handle_cell_click)
+		self.history_model = HistoryTableModel(db_path, page_size, self.tbl_history)
+		self.tbl_history.setModel(self.history_model)
+		font = QtGui.QFont()
+		font.setBold(True)
+		self.tbl_history.horizontalHeader().setFont(font)
+		self.verticalLayout.addWidget(self.tbl_history)
+
+		self.statusLabel = QtWidgets.QLabel(self)
+		self.verticalLayout.addWidget(self.statusLabel)
+
+		self.load_runs()
+
+	# newest run first, with the counters kept in the runs table so nothing is counted here
+	def load_runs(self):
+		conn = sqlite3.connect(self.db_path)
+		try:
+			rows = conn.execute("SELECT run_id, mode, status, started_at, rows, matched FROM runs ORDER BY started_at DESC").fetchall()
+		except sqlite3.Error as e:
+			logger.error('SQLite error: %s', e)
+			rows = []
+		finally:
+			conn.close()
+
+		self.cmb_run.blockSignals(True)
+		self.cmb_run.clear()
+		for run_id, mode, status, started_at, count, matched in rows:
+			self.runs[run_id] = (count, matched)
+			started = time.strftime('%Y-%m-%d %H:%M', time.localtime(started_at)) if started_at else run_id
+			label = f"{started}  {mode or '-'}  {STATUS_LABELS.get(status, status)}  {count} 件（一致 {matched}）"
+			self.cmb_run.addItem(label, run_id)
+		self.cmb_run.blockSignals(False)
+		self.show_run()
+
+	def show_run(self):
+		run_id = self.cmb_run.currentData()
+		only_matched = self.chk_matched.isChecked()
+		self.history_model.load(run_id, only_matched)
+		self.btn_export.setEnabled(run_id is not None)
+		if run_id is None:
+			self.statusLabel.setText("履歴がありません。")
+		else:
+			count, matched = self.runs[run_id]
+			self.statusLabel.setText(f"{matched if only_matched else count} 件")
+
+	def handle_cell_click(self, index):
+		row = index.row()
+		if index.column() == 1 and self.history_model.url_at(row) != "":
+			webbrowser.open(self.history_model.url_at(row))
+
+	def savefile(self):
+		if self.export_thread is not None and self.export_thread.isRunning():
+			self.export_thread.cancel()
+			return
+
+		filename, selected_filter = QFileDialog.getSaveFileName(self, 'Save File', '', "Excel (*.xlsx);;CSV (*.csv)")
+		if filename:
+			if not filename.lower().endswith(('.xlsx', '.csv')):
+				filename += '.csv' if 'csv' in selected_filter else '.xlsx'
+
+			self.export_thread = ExportThread(filename, self.chk_matched.isChecked(), self.cmb_run.currentData(), self.db_path)
+			self.export_thread.export_progress.connect(self.handle_export_progress)
+			self.export_thread.export_finished.connect(self.handle_export_finished)
+			self.btn_export.setText("出力中止")
+			self.cmb_run.setEnabled(False)
+			self.export_thread.start()
+
+	def handle_export_progress(self, done, total):
+		self.statusLabel.setText(f"{total} 件中 {done} 件出力済み")
+
+	def handle_export_finished(self, message):
+		self.statusLabel.setText(message)
+		self.btn_export.setText("出力")
+		self.cmb_run.setEnabled(True)
+		self.export_thread = None
+
+	def done(self, result):
+		if self.export_thread is not None:
+			self.export_thread.cancel()
+			self.export_thread.wait()
+		self.history_model.close()
+		super().done(result)
@@ -0,0 +1,308 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('history_writer')
+
+INSERT_HISTORY = ("INSERT INTO history (id, jan, url, stock, site_price, amazon_price, price_status, run_id) "
+				"VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+CREATE_RUNS = ("CREATE TABLE IF NOT EXISTS runs (run_id text PRIMARY KEY, mode text, status text, started_at real, finished_at real, "
+			"rows integer NOT NULL DEFAULT 0, matched integer NOT NULL DEFAULT 0)")
+# id is the crawl position in ranking mode and the product count in report mode (restarts in every shard),
+# row_id the order the rows were written in
+CREATE_HISTORY = ("CREATE TABLE IF NOT EXISTS history (row_id integer PRIMARY KEY, run_id text NOT NULL, id integer, jan text, url text, "
+				"stock text, site_price integer, amazon_price integer, price_status text)")
+CREATE_HISTORY_INDEXES = [
+	"CREATE INDEX IF NOT EXISTS history_run ON history (run_id)",
+	"CREATE INDEX IF NOT EXISTS history_run_status ON history (run_id, price_status)",
+	"CREATE INDEX IF NOT EXISTS history_jan ON history (jan)",
+]
+CREATE_CHECKPOINT = "CREATE TABLE IF NOT EXISTS checkpoint (id integer PRIMARY KEY CHECK (id = 1), state text, saved_at real)"
+CREATE_SEEN = "CREATE TABLE IF NOT EXISTS seen (run_id text, kind text, key text)"
+
+# run id of history rows written before runs had ids
+LEGACY_RUN_ID = 'legacy'
+
+# start time of a run from its id (see action.new_run_id), None when it is not a time
+def run_started_at(run_id):
+	try:
+		return time.mktime(time.strptime(run_id, '%Y%m%d%H%M%S'))
+	except (TypeError, ValueError):
+		return None
+
+# move a history table of an older version (no key, prices as text, no runs) into the current schema
+def migrate_history(conn):
+	columns = [row[1] for row in conn.execute("PRAGMA table_info(history)")]
+	if len(columns) == 0 or 'row_id' in columns:
+		return
+	run_id = 'run_id' if 'run_id' in columns else 'NULL'
+	conn.execute("ALTER TABLE history RENAME TO history_old")
+	conn.execute(CREATE_HISTORY)
+	conn.execute(
+		"INSERT INTO history (run_id, id, jan, url, stock, site_price, amazon_price, price_status) "
+		f"SELECT COALESCE({run_id}, ?), id, jan, url, stock, CAST(NULLIF(site_price, '') AS integer), "
+		"CAST(NULLIF(amazon_price, '') AS integer), price_status FROM history_old ORDER BY rowid",
+		(LEGACY_RUN_ID,)
+	)
+	conn.execute("DROP TABLE history_old")
+	for (run_id,) in conn.execute("SELECT DISTINCT run_id FROM history").fetchall():
+		conn.execute("INSERT OR IGNORE INTO runs (run_id, mode, status, started_at) VALUES (?, '', 'imported', ?)",
+					(run_id, run_started_at(run_id)))
+		count_run(conn, run_id)
+
+# create the runs, history, checkpoint and seen tables, migrating older databases
+def prepare_history(conn):
+	conn.commit()
+	# other processes of a sharded crawl may be preparing the same database
+	conn.execute("BEGIN IMMEDIATE")
+	try:
+		conn.execute(CREATE_RUNS)
+		migrate_history(conn)
+		conn.execute(CREATE_HISTORY)
+		for sql in CREATE_HISTORY_INDEXES:
+			conn.execute(sql)
+		conn.execute(CREATE_CHECKPOINT)
+		conn.execute(CREATE_SEEN)
+		conn.commit()
+	except BaseException:
+		conn.rollback()
+		raise
+
+# recount the rows of a run, after rows were dropped or imported
+def count_run(conn, run_id):
+	conn.execute(
+		"UPDATE runs SET rows = (SELECT COUNT(*) FROM history WHERE run_id = ?), "
+		"matched = (SELECT COUNT(*) FROM history WHERE run_id = ? AND price_status = 'T') WHERE run_id = ?",
+		(run_id, run_id, run_id)
+	)
+
+# register a run, or mark it running again (resumed, or joined by another shard)
+def begin_run(conn, run_id, mode = ''):
+	conn.execute("INSERT OR IGNORE INTO runs (run_id, mode, status, started_at) VALUES (?, ?, 'running', ?)",
+				(run_id, mode, time.time()))
+	conn.execute("UPDATE runs SET status = 'running', finished_at = NULL WHERE run_id = ?", (run_id,))
+
+# status: 'finished', 'stopped' or 'failed'
+def end_run(conn, run_id, status):
+	conn.execute("UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?", (status, time.time(), run_id))
+
+# a new run: the previous checkpoint goes, runs left running by a closed window count as stopped,
+# and only the newest keep_runs runs keep their rows (all of them when keep_runs is None);
+# the history imported from before runs existed is never pruned
+def start_new_run(conn, run_id, mode = '', keep_runs = None):
+	conn.execute("DELETE FROM checkpoint")
+	conn.execute("DELETE FROM seen")
+	conn.execute("UPDATE runs SET status = 'stopped' WHERE status = 'running'")
+	conn.execute("DELETE FROM history WHERE run_id = ?", (run_id,))
+	conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+	begin_run(conn, run_id, mode)
+	if keep_runs is not None:
+		old_runs = conn.execute("SELECT run_id FROM runs WHERE status != 'imported' ORDER BY started_at DESC LIMIT -1 OFFSET ?", (max(keep_runs, 1),)).fetchall()
+		conn.executemany("DELETE FROM history WHERE run_id = ?", old_runs)
+		conn.executemany("DELETE FROM runs WHERE run_id = ?", old_runs)
+
+# crawl state to commit together with the rows queued before it,
+# plus the asins/jans (kind, key) handled up to that point
+class Checkpoint:
+	def __init__(self, state, seen = ()):
+		self.state = state
+		self.seen = list(seen)
+
+# single writer thread that batches history rows into executemany transactions
+class HistoryWriter:
+	# max_failures: commits in a row that may fail before the crawl is told the history is not being saved
+	def __init__(self, db_path = 'database.db', batch_size = 500, flush_interval = 2.0, metrics = None, keep_runs = None, max_failures = 3):
+		self.db_path = db_path
+		self.metrics = metrics
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.keep_runs = keep_runs
+		self.max_failures = max_failures
+		self.failures = 0
+		self.queue = queue.Queue()
+		self.thread = None
+		self.run_id = ''
+		self.end_status = None
+		self.error = None  # why the writer thread could not open the database or keeps failing to commit
+
+	# create or migrate the tables up front, so the window can read the history before the first run
+	def prepare(self):
+		conn = sqlite3.connect(self.db_path, timeout = 60)
+		try:
+			prepare_history(conn)
+		except sqlite3.Error as e:
+			logger.error('SQLite error: %s', e)
+		finally:
+			conn.close()
+
+	# reset starts a new run (see start_new_run), resume_after drops rows written after the resumed checkpoint
+	def start(self, run_id = '', mode = '', reset = False, resume_after = None):
+		if self.thread is not None and self.thread.is_alive():
+			return
+		self.run_id = run_id
+		self.end_status = None
+		self.error = None
+		self.failures = 0
+		self.thread = threading.Thread(target = self.run, args = (mode, reset, resume_after), name = 'history-writer', daemon = True)
+		self.thread.start()
+
+	# raise instead of queueing for a writer thread that gave up, so the crawl reports it
+	def check(self):
+		if self.error is not None:
+			raise sqlite3.OperationalError(f"history is not being saved: {self.error}")
+
+	def write(self, row):
+		self.check()
+		self.queue.put(row + (self.run_id,))
+
+	# state is None to clear the checkpoint after a finished run
+	def write_checkpoint(self, state, seen = ()):
+		self.check()
+		self.queue.put(Checkpoint(state, seen))
+
+	# (kind, key) of the asins/jans saved with the checkpoints of a run
+	def load_seen(self, run_id):
+		conn = sqlite3.connect(self.db_path)
+		try:
+			conn.execute(CREATE_SEEN)
+			return conn.execute("SELECT kind, key FROM seen WHERE run_id = ?", (run_id,)).fetchall()
+		except sqlite3.Error as e:
+			logger.error('SQLite error: %s', e)
+			return []
+		finally:
+			conn.close()
+
+	def load_checkpoint(self):
+		conn = sqlite3.connect(self.db_path)
+		try:
+			conn.execute(CREATE_CHECKPOINT)
+			row = conn.execute("SELECT state FROM checkpoint WHERE id = 1").fetchone()
+		except sqlite3.Error as e:
+			logger.error('SQLite error: %s', e)
+			row = None
+		finally:
+			conn.close()
+		return json.loads(row[0]) if row else None
+
+	# block until everything queued so far is committed
+	def flush(self):
+		if self.thread is None or not self.thread.is_alive():
+			return
+		done = threading.Event()
+		self.queue.put(done)
+		while not done.wait(0.5):
+			if not self.thread.is_alive():
+				return
+
+	# commit pending rows and stop the writer thread, recording how the run ended unless status is None
+	def stop(self, status = None):
+		if self.thread is None:
+			return
+		self.end_status = status
+		self.queue.put(None)
+		self.thread.join()
+		self.thread = None
+
+	def open_connection(self, mode, reset, resume_after):
+		# other processes of a sharded crawl may be committing at the same time
+		conn = sqlite3.connect(self.db_path, timeout = 60)
+		try:
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			prepare_history(conn)
+			with conn:
+				if reset:
+					start_new_run(conn, self.run_id, mode, self.keep_runs)
+				else:
+					begin_run(conn, self.run_id, mode)
+					if resume_after is not None:
+						conn.execute("DELETE FROM history WHERE run_id = ? AND id > ?", (self.run_id, resume_after))
+						count_run(conn, self.run_id)
+		except BaseException:
+			conn.close()
+			raise
+		return conn
+
+	# commit the rows and the checkpoint after them; on failure both are kept for the next commit
+	# and False is returned
+	def commit_rows(self, conn, rows, checkpoint = None):
+		if len(rows) == 0 and checkpoint is None:
+			return True
+		started = time.perf_counter()
+		error = None
+		try:
+			with conn:
+				conn.executemany(INSERT_HISTORY, rows)
+				if len(rows) > 0:
+					conn.execute("UPDATE runs SET rows = rows + ?, matched = matched + ? WHERE run_id = ?",
+								(len(rows), sum(1 for row in rows if row[6] == 'T'), self.run_id))
+				if checkpoint is not None:
+					conn.executemany("INSERT INTO seen (run_id, kind, key) VALUES (?, ?, ?)",
+									[(self.run_id, kind, key) for kind, key in checkpoint.seen])
+					if checkpoint.state is None:
+						conn.execute("DELETE FROM checkpoint")
+					else:
+						conn.execute("INSERT OR REPLACE INTO checkpoint (id, state, saved_at) VALUES (1, ?, ?)",
+									(json.dumps(checkpoint.state), time.time()))
+		except sqlite3.Error as e:
+			logger.error('SQLite error: %s', e)
+			error = str(e)
+		if self.metrics is not None:
+			self.metrics.record('sqlite', time.perf_counter() - started, len(rows), error is not None)
+		if error is not None:
+			self.failures += 1
+			if self.failures >= self.max_failures and self.error is None:
+				self.error = f"{len(rows)} rows could not be committed: {error}"
+			return False
+		self.failures = 0
+		rows.clear()
+		return True
+
+	def run(self, mode, reset, resume_after):
+		try:
+			conn = self.open_connection(mode, reset, resume_after)
+		except sqlite3.Error as e:
+			logger.error('SQLite error: %s', e)
+			self.error = str(e)
+			return
+		rows = []
+		checkpoint = None
+		deadline = time.monotonic() + self.flush_interval
+		try:
+			while True:
+				try:
+					item = self.queue.get(timeout = max(deadline - time.monotonic(), 0))
+				except queue.Empty:
+					item = ''
+
+				if item is None:
+					break
+				elif isinstance(item, threading.Event):
+					if self.commit_rows(conn, rows, checkpoint):
+						checkpoint = None
+					item.set()
+				elif isinstance(item, Checkpoint):
+					# rides along with the next commit; rows past it are dropped again on resume
+					if checkpoint is not None:
+						item.seen = checkpoint.seen + item.seen
+					checkpoint = item
+				elif item != '':
+					rows.append(item)
+
+				# after a failed commit only retry every flush_interval, not on every row
+				if (len(rows) >= self.batch_size and self.failures == 0) or time.monotonic() >= deadline:
+					if self.commit_rows(conn, rows, checkpoint):
+						checkpoint = None
+					deadline = time.monotonic() + self.flush_interval
+		finally:
+			self.commit_rows(conn, rows, checkpoint)
+			if self.end_status is not None:
+				try:
+					with conn:
+						end_run(conn, self.run_id, self.end_status)
+				except sqlite3.Error as e:
+					logger.error('SQLite error: %s', e)
+			conn.close()
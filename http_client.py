@@ -0,0 +1,55 @@
+import requests
+
+from requests.adapters import HTTPAdapter
+
+# shared keep-alive client for SP-API, BookOff and report downloads
+class HttpClient:
+	def __init__(self, pool_sizes = None, default_pool_size = 10, timeout = (5, 30)):
+		self.timeout = timeout
+		self.session = requests.Session()
+		self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+		self.adapters = []
+
+		default_adapter = HTTPAdapter(pool_connections = 20, pool_maxsize = default_pool_size)
+		self.session.mount('https://', default_adapter)
+		self.session.mount('http://', default_adapter)
+		self.adapters.append(default_adapter)
+
+		# per-host pools, e.g. {'shopping.bookoff.co.jp': 32}
+		for host, pool_size in (pool_sizes or {}).items():
+			adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+			self.session.mount(f'https://{host}', adapter)
+			self.session.mount(f'http://{host}', adapter)
+			self.adapters.append(adapter)
+
+	def request(self, method, url, **kwargs):
+		kwargs.setdefault('timeout', self.timeout)
+		return self.session.request(method, url, **kwargs)
+
+	def get(self, url, **kwargs):
+		return self.request('GET', url, **kwargs)
+
+	def post(self, url, **kwargs):
+		return self.request('POST', url, **kwargs)
+
+	# connections opened vs reused across all host pools
+	def stats(self):
+		opened = 0
+		requests_made = 0
+		for adapter in self.adapters:
+			pools = adapter.poolmanager.pools
+			for key in pools.keys():
+				pool = pools.get(key)
+				if pool is None:
+					continue
+				opened += pool.num_connections
+				requests_made += pool.num_requests
+
+		return {
+			'opened': opened,
+			'reused': max(requests_made - opened, 0),
+			'requests': requests_made,
+		}
+
+	def close(self):
+		self.session.close()
@@ -9,6 +9,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     super(MainWindow, self).__init__(*args, **kwargs)
     self.setupUi(self)
 
+  def closeEvent(self, event):
+    Ui_MainWindow.closeEvent(self, event)
+
 def main ():
   app = QtWidgets.QApplication(sys.argv)
   window = MainWindow()
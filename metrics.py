@@ -0,0 +1,122 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('metrics')
+
+# upper bounds (ms) of the histogram buckets, the last one catches the rest
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float('inf')]
+
+# nearest-rank percentile of sorted values
+def percentile(values, q):
+	if len(values) == 0:
+		return 0.0
+	rank = max(int(round(q / 100 * len(values) + 0.5)) - 1, 0)
+	return values[min(rank, len(values) - 1)]
+
+# counters since the start of the run plus the last `window` calls of one stage
+class StageMetrics:
+	def __init__(self, window = 1000):
+		self.count = 0
+		self.errors = 0
+		self.items = 0
+		self.seconds = 0.0
+		self.recent = deque(maxlen = window)  # (finished_at, seconds, items)
+
+	def record(self, seconds, items, error, now):
+		self.count += 1
+		self.items += items
+		self.seconds += seconds
+		if error:
+			self.errors += 1
+		self.recent.append((now, seconds, items))
+
+	def snapshot(self, now):
+		durations = sorted(seconds for _, seconds, _ in self.recent)
+		histogram = [0] * len(BUCKETS_MS)
+		for seconds in durations:
+			histogram[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+		# items per second over the span the window covers
+		rate = 0.0
+		if len(self.recent) > 1:
+			span = now - (self.recent[0][0] - self.recent[0][1])
+			if span > 0:
+				rate = sum(items for _, _, items in self.recent) / span
+
+		return {
+			'count': self.count,
+			'errors': self.errors,
+			'items': self.items,
+			'seconds': round(self.seconds, 3),
+			'rate': round(rate, 2),
+			'mean_ms': round(1000 * sum(durations) / len(durations), 2) if durations else 0.0,
+			'p50_ms': round(percentile(durations, 50) * 1000, 2),
+			'p95_ms': round(percentile(durations, 95) * 1000, 2),
+			'p99_ms': round(percentile(durations, 99) * 1000, 2),
+			'histogram': dict(zip([str(bound) for bound in BUCKETS_MS], histogram)),
+		}
+
+# per-stage timings of a crawl, shared by the crawl threads and the window
+class Metrics:
+	def __init__(self, window = 1000):
+		self.window = window
+		self.stages = {}
+		self.lock = threading.Lock()
+
+	def record(self, stage, seconds, items = 1, error = False):
+		now = time.monotonic()
+		with self.lock:
+			if stage not in self.stages:
+				self.stages[stage] = StageMetrics(self.window)
+			self.stages[stage].record(seconds, items, error, now)
+
+	# time the block as one call of stage; an exception counts as an error
+	@contextmanager
+	def timer(self, stage, items = 1):
+		started = time.perf_counter()
+		error = False
+		try:
+			yield
+		except BaseException:
+			error = True
+			raise
+		finally:
+			self.record(stage, time.perf_counter() - started, items, error)
+
+	def snapshot(self):
+		now = time.monotonic()
+		with self.lock:
+			return {stage: metrics.snapshot(now) for stage, metrics in self.stages.items()}
+
+	# (stage, mean ms) with the highest mean latency over the recent calls, or None
+	def slowest(self):
+		with self.lock:
+			means = [
+				(sum(seconds for _, seconds, _ in metrics.recent) / len(metrics.recent), stage)
+				for stage, metrics in self.stages.items() if len(metrics.recent) > 0
+			]
+		if len(means) == 0:
+			return None
+		seconds, stage = max(means)
+		return stage, round(seconds * 1000, 1)
+
+	def reset(self):
+		with self.lock:
+			self.stages = {}
+
+# replace the metrics file in one step, so readers never see half a file
+def write_metrics_file(path, data):
+	temp_path = f'{path}.tmp'
+	try:
+		with open(temp_path, 'w', encoding = 'utf-8') as file:
+			json.dump(data, file, ensure_ascii = False, indent = 1)
+		os.replace(temp_path, path)
+	except OSError as e:
+		logger.warning('Metrics error: %s', e)
@@ -0,0 +1,161 @@
+import queue
+import threading
+
+# end of the stream on a queue
+DONE = object()
+
+# polling interval of blocked queue operations, so an aborted pipeline unblocks
+POLL_INTERVAL = 0.1
+
+class Aborted(Exception):
+	pass
+
+# passes through the stages untouched and in order (e.g. the end of a page)
+class Marker:
+	pass
+
+# an exception raised for one item, handed on in place of its results
+class StageError(Marker):
+	def __init__(self, error):
+		self.error = error
+
+# func maps one item to a list of output items; workers threads share the inbox,
+# results leave in input order; finish() may add items once the input is exhausted
+class Stage:
+	def __init__(self, name, func, workers = 1, queue_size = None, finish = None):
+		self.name = name
+		self.func = func
+		self.workers = max(workers, 1)
+		self.queue_size = queue_size or 2 * self.workers
+		self.finish = finish
+		self.take_lock = threading.Lock()
+		self.turn = threading.Condition()
+		self.taken = 0
+		self.emitted = 0
+		self.exhausted = False
+
+# source items flow through the stages over bounded queues, each stage with its own workers
+class Pipeline:
+	def __init__(self, source, stages, queue_size = 64):
+		self.source = source
+		self.stages = stages
+		self.queues = [queue.Queue(maxsize = stage.queue_size) for stage in stages]
+		self.queues.append(queue.Queue(maxsize = queue_size))
+		self.threads = []
+		self.aborted = threading.Event()
+
+	def put(self, q, item):
+		while True:
+			try:
+				q.put(item, timeout = POLL_INTERVAL)
+				return
+			except queue.Full:
+				if self.aborted.is_set():
+					raise Aborted()
+
+	def get(self, q):
+		while True:
+			try:
+				return q.get(timeout = POLL_INTERVAL)
+			except queue.Empty:
+				if self.aborted.is_set():
+					raise Aborted()
+
+	def start(self):
+		self.threads.append(threading.Thread(target = self.feed, name = 'pipeline-source', daemon = True))
+		for index, stage in enumerate(self.stages):
+			for worker in range(stage.workers):
+				self.threads.append(threading.Thread(
+					target = self.work, args = (stage, self.queues[index], self.queues[index + 1]),
+					name = f'pipeline-{stage.name}-{worker}', daemon = True
+				))
+		for thread in self.threads:
+			thread.start()
+
+	def feed(self):
+		try:
+			try:
+				for item in self.source:
+					self.put(self.queues[0], item)
+			except Aborted:
+				return
+			except Exception as e:
+				self.put(self.queues[0], StageError(e))
+			self.put(self.queues[0], DONE)
+		except Aborted:
+			pass
+
+	# wait until the items taken before seq have been handed on
+	def wait_turn(self, stage, seq):
+		while stage.emitted != seq:
+			if self.aborted.is_set():
+				raise Aborted()
+			stage.turn.wait(POLL_INTERVAL)
+
+	def emit(self, stage, seq, outputs, outbox):
+		with stage.turn:
+			self.wait_turn(stage, seq)
+			for output in outputs:
+				self.put(outbox, output)
+			stage.emitted += 1
+			stage.turn.notify_all()
+
+	def work(self, stage, inbox, outbox):
+		try:
+			while True:
+				with stage.take_lock:
+					if stage.exhausted:
+						return
+					item = self.get(inbox)
+					seq = stage.taken
+					if item is DONE:
+						stage.exhausted = True
+					else:
+						stage.taken += 1
+
+				if item is DONE:
+					self.finish(stage, seq, outbox)
+					return
+
+				if isinstance(item, Marker):
+					outputs = [item]
+				else:
+					try:
+						outputs = stage.func(item)
+					except Exception as e:
+						outputs = [StageError(e)]
+				self.emit(stage, seq, outputs, outbox)
+		except Aborted:
+			pass
+
+	# after the last item: the stage's closing items, then DONE for the next stage
+	def finish(self, stage, seq, outbox):
+		with stage.turn:
+			self.wait_turn(stage, seq)
+		outputs = []
+		if stage.finish is not None:
+			try:
+				outputs = stage.finish()
+			except Exception as e:
+				outputs = [StageError(e)]
+		for output in outputs:
+			self.put(outbox, output)
+		self.put(outbox, DONE)
+
+	# the items leaving the last stage; closing the generator aborts the pipeline
+	def results(self):
+		self.start()
+		try:
+			while True:
+				item = self.get(self.queues[-1])
+				if item is DONE:
+					return
+				yield item
+		finally:
+			self.close()
+
+	def close(self):
+		if any(thread.is_alive() for thread in self.threads):
+			self.aborted.set()
+		for thread in self.threads:
+			thread.join()
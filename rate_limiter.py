@@ -0,0 +1,200 @@
+import multiprocessing
+import random
+import threading
+import time
+
+# default (requests per second, burst) of the SP-API operations we call
+DEFAULT_LIMITS = {
+	'getReports': (0.0222, 10),
+	'getReportDocument': (0.0167, 15),
+	'searchCatalogItems': (2, 2),
+	'getCompetitivePricing': (0.5, 1),
+	'getItemOffersBatch': (0.1, 1),
+}
+
+# token bucket handing out reservations, so callers queue in arrival order
+class TokenBucket:
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	# take a token and return how long the caller has to wait for it
+	def reserve(self):
+		with self.lock:
+			self.refill(time.monotonic())
+			self.tokens -= 1
+			if self.tokens >= 0:
+				return 0
+			return -self.tokens / self.rate
+
+	def set_rate(self, rate):
+		with self.lock:
+			self.refill(time.monotonic())
+			self.rate = rate
+
+# token bucket living in shared memory, so several processes draw from one budget
+class SharedTokenBucket:
+	def __init__(self, rate, burst):
+		# rate, burst, tokens, updated
+		self.values = multiprocessing.Array('d', [rate, burst, burst, time.time()])
+
+	@property
+	def rate(self):
+		return self.values[0]
+
+	def refill(self, now):
+		rate, burst, tokens, updated = self.values[:]
+		self.values[2] = min(burst, tokens + max(now - updated, 0) * rate)
+		self.values[3] = now
+
+	def reserve(self):
+		with self.values.get_lock():
+			self.refill(time.time())
+			self.values[2] -= 1
+			if self.values[2] >= 0:
+				return 0
+			return -self.values[2] / self.values[0]
+
+	def set_rate(self, rate):
+		with self.values.get_lock():
+			self.refill(time.time())
+			self.values[0] = rate
+
+# one shared bucket per operation, created before the worker processes start
+def create_shared_buckets(limits = None):
+	all_limits = dict(DEFAULT_LIMITS)
+	all_limits.update(limits or {})
+	return {operation: SharedTokenBucket(rate, burst) for operation, (rate, burst) in all_limits.items()}
+
+# per-operation statistics
+class OperationStats:
+	def __init__(self):
+		self.queued = 0
+		self.requests = 0
+		self.throttled = 0
+		self.wait_total = 0.0
+		self.wait_max = 0.0
+
+# schedules SP-API requests through a token bucket per operation
+class SpApiScheduler:
+	# on_rejected(response) is told about 401/403 answers, i.e. an access token the API no longer takes;
+	# access_token() then gives the token the request is sent once more with ('' to give up)
+	def __init__(self, http, limits = None, max_retries = 8, base_backoff = 1.0, max_backoff = 60.0, buckets = None,
+				on_rejected = None, access_token = None):
+		self.http = http
+		self.on_rejected = on_rejected
+		self.access_token = access_token
+		self.limits = dict(DEFAULT_LIMITS)
+		self.limits.update(limits or {})
+		self.max_retries = max_retries
+		self.base_backoff = base_backoff
+		self.max_backoff = max_backoff
+		self.buckets = dict(buckets or {})
+		self.operation_stats = {}
+		self.lock = threading.Lock()
+
+	def bucket(self, operation):
+		with self.lock:
+			if operation not in self.buckets:
+				rate, burst = self.limits.get(operation, (1, 1))
+				self.buckets[operation] = TokenBucket(rate, burst)
+			if operation not in self.operation_stats:
+				self.operation_stats[operation] = OperationStats()
+			return self.buckets[operation], self.operation_stats[operation]
+
+	def wait(self, stats, seconds):
+		if seconds <= 0:
+			return
+		with self.lock:
+			stats.queued += 1
+		try:
+			time.sleep(seconds)
+		finally:
+			with self.lock:
+				stats.queued -= 1
+				stats.wait_total += seconds
+				stats.wait_max = max(stats.wait_max, seconds)
+
+	# follow the rate the API reports for this operation
+	def update_rate(self, bucket, response):
+		limit = response.headers.get('x-amzn-RateLimit-Limit')
+		if not limit:
+			return
+		try:
+			rate = float(limit)
+		except ValueError:
+			return
+		if rate > 0 and rate != bucket.rate:
+			bucket.set_rate(rate)
+
+	def backoff(self, attempt, response):
+		retry_after = response.headers.get('Retry-After')
+		if retry_after:
+			try:
+				return float(retry_after)
+			except ValueError:
+				pass
+		delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+		return random.uniform(delay / 2, delay)
+
+	# headers to send a rejected request again with, None when there is no new token
+	def renew_token(self, headers):
+		if self.access_token is None or headers is None or 'x-amz-access-token' not in headers:
+			return None
+		token = self.access_token()
+		if not token:
+			return None
+		return dict(headers, **{'x-amz-access-token': token})
+
+	# send a request, queueing behind the operation's rate limit, retrying 429/503
+	# and sending a request whose access token was rejected once more with a new token
+	def request(self, operation, method, url, **kwargs):
+		bucket, stats = self.bucket(operation)
+		attempt = 0
+		renewed = False
+		while True:
+			self.wait(stats, bucket.reserve())
+			response = self.http.request(method, url, **kwargs)
+			with self.lock:
+				stats.requests += 1
+			self.update_rate(bucket, response)
+			if response.status_code in (401, 403):
+				if self.on_rejected is not None:
+					self.on_rejected(response)
+				headers = None if renewed else self.renew_token(kwargs.get('headers'))
+				if headers is not None:
+					kwargs['headers'] = headers
+					renewed = True
+					continue
+
+			if response.status_code not in (429, 503) or attempt >= self.max_retries:
+				return response
+
+			with self.lock:
+				stats.throttled += 1
+			self.wait(stats, self.backoff(attempt, response))
+			attempt += 1
+
+	def get(self, operation, url, **kwargs):
+		return self.request(operation, 'GET', url, **kwargs)
+
+	# queue depth, wait time and throttling per operation
+	def stats(self):
+		with self.lock:
+			return {
+				operation: {
+					'queued': stats.queued,
+					'requests': stats.requests,
+					'throttled': stats.throttled,
+					'wait_total': round(stats.wait_total, 3),
+					'wait_max': round(stats.wait_max, 3),
+				}
+				for operation, stats in self.operation_stats.items()
+			}
@@ -0,0 +1,53 @@
+import codecs
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# decompress gzip chunks as they arrive (plain chunks pass through)
+def iter_gunzip(chunks):
+	chunks = iter(chunks)
+	decompressor = None
+	for chunk in chunks:
+		if not chunk:
+			continue
+		if decompressor is None:
+			if not chunk.startswith(GZIP_MAGIC):
+				yield chunk
+				yield from chunks
+				return
+			decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		yield decompressor.decompress(chunk)
+
+	if decompressor is not None:
+		yield decompressor.flush()
+
+# split byte chunks into text lines without holding more than one chunk
+def iter_lines(chunks, encoding = 'utf-8'):
+	decoder = codecs.getincrementaldecoder(encoding)(errors = 'replace')
+	buffer = ''
+	for chunk in chunks:
+		buffer += decoder.decode(chunk)
+		lines = buffer.split('\n')
+		buffer = lines.pop()
+		yield from lines
+
+	buffer += decoder.decode(b'', final = True)
+	if buffer:
+		yield buffer
+
+# parse a GET_MERCHANT_LISTINGS_ALL_DATA line
+def parse_listing_line(line):
+	line = line.strip().split(',')
+	return line[0].split('\t')
+
+def is_target_listing(fields):
+	return len(fields) >= 2 and fields[-1] == 'Active' and fields[-2] == '送料無料(お急ぎ便無し)'
+
+# yield the fields of active listings, skipping the header line
+def iter_listing_rows(lines):
+	for i, line in enumerate(lines):
+		if i == 0:
+			continue
+		fields = parse_listing_line(line)
+		if is_target_listing(fields):
+			yield fields
@@ -0,0 +1,73 @@
+import hashlib
+import math
+import threading
+
+# fixed size set membership with false positives at about error_rate below capacity keys
+class BloomFilter:
+	def __init__(self, capacity = 2000000, error_rate = 1e-7):
+		self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+		self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+		self.bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+
+	# double hashing over one 128 bit digest
+	def positions(self, key):
+		digest = hashlib.blake2b(key.encode('utf-8'), digest_size = 16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+	def __contains__(self, key):
+		return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+	def add(self, key):
+		for position in self.positions(key):
+			self.bits[position >> 3] |= 1 << (position & 7)
+		self.count += 1
+
+# asins and jans already handled in this run: a Bloom filter of the checkpointed keys plus
+# the keys of pages still in flight, tagged with their page so a checkpoint can commit them
+class SeenSet:
+	def __init__(self, capacity = 2000000, error_rate = 1e-7, enabled = True):
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.enabled = enabled
+		self.lock = threading.Lock()
+		self.reset()
+
+	# start over, with the (kind, key) rows saved with the checkpoint of a resumed run
+	def reset(self, rows = ()):
+		with self.lock:
+			self.filter = BloomFilter(self.capacity, self.error_rate)
+			self.in_flight = {}
+			self.skipped = 0
+			for kind, key in rows:
+				self.filter.add(f'{kind}:{key}')
+
+	# keys not seen before, in order; they count as seen from now on
+	# (tag None: committed right away, nothing to checkpoint)
+	def first_seen(self, kind, keys, tag = None):
+		if not self.enabled:
+			return list(keys)
+		fresh = []
+		with self.lock:
+			for key in keys:
+				name = f'{kind}:{key}'
+				if name in self.in_flight or name in self.filter:
+					self.skipped += 1
+					continue
+				if tag is None:
+					self.filter.add(name)
+				else:
+					self.in_flight[name] = tag
+				fresh.append(key)
+		return fresh
+
+	# move the keys of pages up to tag into the filter, returning them as (kind, key) to persist
+	def commit(self, tag):
+		with self.lock:
+			done = [name for name, name_tag in self.in_flight.items() if name_tag <= tag]
+			for name in done:
+				del self.in_flight[name]
+				self.filter.add(name)
+		return [tuple(name.split(':', 1)) for name in done]
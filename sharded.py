@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import signal
+import sqlite3
+
+import action
+import config
+
+from crawler import Crawler
+from history_writer import end_run, prepare_history, start_new_run
+from rate_limiter import create_shared_buckets
+
+logger = logging.getLogger('sharded')
+
+# set in each worker process by init_worker
+shared_buckets = None
+stop_event = None
+
+# split every category into page ranges of shard_pages pages
+def plan_shards(categories, pages_per_category, shard_pages):
+	shards = []
+	for category in categories:
+		for first_page in range(1, pages_per_category + 1, shard_pages):
+			shards.append((category, first_page, min(first_page + shard_pages - 1, pages_per_category)))
+	return shards
+
+def init_worker(buckets, event):
+	global shared_buckets, stop_event
+	shared_buckets = buckets
+	stop_event = event
+	# the parent owns ctrl+c and tells the workers through stop_event
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	logging.basicConfig(level = logging.INFO, format = '%(asctime)s %(processName)s %(levelname)s %(message)s')
+
+# crawl one shard in a worker process, returning its counters
+def crawl_shard(shard, run_id, discovery_backend):
+	category, first_page, last_page = shard
+	handler = action.ActionManagement()
+	if discovery_backend:
+		handler.discovery_backend = discovery_backend
+	handler.use_rate_limit_buckets(shared_buckets)
+	# shards would overwrite each other's metrics file
+	handler.metrics_file = None
+	handler.start_shard(run_id)
+
+	crawler = Crawler(
+		handler,
+		should_stop = stop_event.is_set,
+		refresh_rate = 0.1,
+		on_progress = lambda stats: logger.info('%s pages %d-%d processed=%d matched=%d', category, first_page, last_page, stats['processed'], stats['matched']),
+		on_error = lambda message: logger.warning('%s error: %s', category, message)
+	)
+	try:
+		stats = crawler.run_pages(category, first_page, last_page)
+	finally:
+		handler.close()
+	stats['shard'] = shard
+	return stats
+
+# run the shards of one crawl on a process pool, all writing to one history under one run id
+class ShardedCrawl:
+	def __init__(self, processes = None, categories = None, pages_per_category = 400, shard_pages = 50, discovery_backend = None, db_path = 'database.db'):
+		self.processes = processes or multiprocessing.cpu_count()
+		self.categories = categories or list(action.BROWSE_URLS)
+		self.pages_per_category = pages_per_category
+		self.shard_pages = shard_pages
+		self.discovery_backend = discovery_backend
+		self.db_path = db_path
+		self.stop_event = multiprocessing.Event()
+		self.run_id = action.new_run_id()
+
+	def stop(self):
+		self.stop_event.set()
+
+	# a sharded run is a new run, like a normal start
+	def begin_history(self):
+		conn = sqlite3.connect(self.db_path, timeout = 60)
+		try:
+			conn.execute("PRAGMA journal_mode=WAL")
+			prepare_history(conn)
+			with conn:
+				start_new_run(conn, self.run_id, 'sharded', getattr(config, 'HISTORY_KEEP_RUNS', None))
+		finally:
+			conn.close()
+
+	# once all shards are done: the workers each mark the run running again when they join it
+	def end_history(self, status):
+		conn = sqlite3.connect(self.db_path, timeout = 60)
+		try:
+			with conn:
+				end_run(conn, self.run_id, status)
+		except sqlite3.Error as e:
+			logger.error('could not record the end of run %s: %s', self.run_id, e)
+		finally:
+			conn.close()
+
+	# returns merged counters of all shards
+	def run(self):
+		self.begin_history()
+		shards = plan_shards(self.categories, self.pages_per_category, self.shard_pages)
+		buckets = create_shared_buckets(getattr(config, 'SP_API_LIMITS', None))
+		totals = {'processed': 0, 'matched': 0, 'skipped': 0, 'errored': 0, 'duplicates': 0, 'shards': 0}
+
+		logger.info('run %s: %d shards on %d processes', self.run_id, len(shards), self.processes)
+		pool = multiprocessing.Pool(self.processes, initializer = init_worker, initargs = (buckets, self.stop_event))
+		try:
+			results = [pool.apply_async(crawl_shard, (shard, self.run_id, self.discovery_backend)) for shard in shards]
+			for result in results:
+				stats = result.get()
+				for key in ('processed', 'matched', 'skipped', 'errored', 'duplicates'):
+					totals[key] += stats[key]
+				totals['shards'] += 1
+				logger.info('shard %s done: processed=%d matched=%d', stats['shard'], stats['processed'], stats['matched'])
+			pool.close()
+		except BaseException:
+			self.stop_event.set()
+			pool.terminate()
+			self.end_history('failed')
+			raise
+		finally:
+			pool.join()
+		self.end_history('stopped' if self.stop_event.is_set() else 'finished')
+		return totals
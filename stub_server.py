@@ -0,0 +1,228 @@
+import argparse
+import copy
+import gzip
+import hashlib
+import json
+import multiprocessing
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+DATA_ASIN_RE = re.compile(rb'data-asin="(B0[0-9A-Z]{8})"')
+DEFAULT_BOOKOFF_PAGES = ['in_stock'] * 6 + ['out_of_stock'] * 2 + ['not_found'] * 2
+
+# deterministic fake asin of a sales rank slot
+def asin_for(category, page_number, index):
+	digest = hashlib.md5(f'{category}:{page_number}:{index}'.encode()).hexdigest().upper()
+	return 'B0' + digest[:8]
+
+# deterministic 13 digit jan of an asin
+def jan_for(asin):
+	return '45' + str(int(hashlib.md5(asin.encode()).hexdigest()[:12], 16)).zfill(15)[:11]
+
+def price_for(asin, low, high):
+	return low + int(hashlib.md5(asin.encode()).hexdigest()[:6], 16) % (high - low)
+
+# recorded SP-API, Amazon and BookOff responses, rewritten for the requested asins and jans
+class Fixtures:
+	def __init__(self, folder = FIXTURES, report_rows = 5000):
+		self.folder = Path(folder)
+		self.token = self.read_json('sp_api/token.json')
+		self.reports = self.read_json('sp_api/reports.json')
+		self.report_document = (self.folder / 'sp_api/report_document.json').read_text(encoding = 'utf-8')
+		self.catalog_item = self.read_json('sp_api/catalog_item.json')
+		self.competitive_price = self.read_json('sp_api/competitive_price.json')
+		self.item_offers = self.read_json('sp_api/item_offers.json')
+		self.browse_page = (self.folder / 'amazon/browse_page.html').read_bytes()
+		self.bookoff_pages = {
+			filepath.stem: filepath.read_bytes() for filepath in (self.folder / 'bookoff').glob('*.html')
+		}
+		self.report = self.build_report((self.folder / 'report/merchant_listings.txt').read_text(encoding = 'utf-8'), report_rows)
+
+	def read_json(self, name):
+		return json.loads((self.folder / name).read_text(encoding = 'utf-8'))
+
+	# repeat the recorded listings up to report_rows lines, each with its own asin
+	def build_report(self, text, report_rows):
+		header, *rows = text.rstrip('\n').split('\n')
+		lines = [header]
+		for i in range(report_rows):
+			fields = rows[i % len(rows)].split('\t')
+			fields[0] = f'BK-{i:07d}'
+			fields[1] = asin_for('report', 0, i)
+			lines.append('\t'.join(fields))
+		return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+	# the first slot repeats the previous page, as a product that moved up while the crawl turned the page
+	def browse(self, category, page_number):
+		index = iter(range(1000))
+		def slot(match):
+			i = next(index)
+			asin = asin_for(category, page_number - 1, 1) if i == 0 and page_number > 1 else asin_for(category, page_number, i)
+			return b'data-asin="' + asin.encode() + b'"'
+		return DATA_ASIN_RE.sub(slot, self.browse_page)
+
+	# every other item has no list_price, so the pricing fallback is exercised too;
+	# like the real API the items do not come back in the order asked for
+	def catalog(self, asins):
+		items = []
+		for asin in sorted(asins):
+			item = copy.deepcopy(self.catalog_item)
+			item['asin'] = asin
+			for identifier in item['identifiers'][0]['identifiers']:
+				identifier['identifier'] = jan_for(asin)
+			if price_for(asin, 0, 2) == 0:
+				del item['attributes']['list_price']
+			else:
+				item['attributes']['list_price'][0]['value'] = price_for(asin, 1500, 9000)
+			items.append(item)
+		return {'numberOfResults': len(items), 'items': items}
+
+	# one asin in ten is unknown to the pricing API
+	def pricing(self, asins):
+		payload = []
+		for asin in asins:
+			if price_for(asin, 0, 10) == 0:
+				payload.append({'status': 'ClientError', 'ASIN': asin, 'Error': {'code': 'InvalidInput', 'message': 'ASIN is not valid'}})
+				continue
+			entry = copy.deepcopy(self.competitive_price)
+			entry['ASIN'] = asin
+			entry['Product']['Identifiers']['MarketplaceASIN']['ASIN'] = asin
+			price = entry['Product']['CompetitivePricing']['CompetitivePrices'][0]['Price']
+			price['ListingPrice']['Amount'] = price['LandedPrice']['Amount'] = float(price_for(asin, 1500, 9000))
+			payload.append(entry)
+		return {'payload': payload}
+
+	def offers(self, requests):
+		responses = []
+		for request in requests:
+			asin = request['uri'].split('/')[-2]
+			response = copy.deepcopy(self.item_offers)
+			response['request']['Asin'] = asin
+			payload = response['body']['payload']
+			payload['ASIN'] = payload['Identifier']['ASIN'] = asin
+			for price in payload['Summary']['BuyBoxPrices'] + payload['Summary']['LowestPrices']:
+				price['ListingPrice']['Amount'] = float(price_for(asin, 1500, 9000))
+			responses.append(response)
+		return {'responses': responses}
+
+	def bookoff(self, jan):
+		name = DEFAULT_BOOKOFF_PAGES[int(jan) % len(DEFAULT_BOOKOFF_PAGES)]
+		return self.bookoff_pages[name]
+
+# serves the fixtures on the paths of the real hosts, optionally adding latency
+class StubHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# headers and body leave in one write, so delayed acks don't add 40 ms per request
+	wbufsize = 64 * 1024
+	disable_nagle_algorithm = True
+
+	def log_message(self, format, *args):
+		pass
+
+	def send_body(self, body, content_type, status = 200, headers = None):
+		time.sleep(self.server.latency)
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def send_json(self, data):
+		self.send_body(json.dumps(data, ensure_ascii = False).encode('utf-8'), 'application/json')
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		if self.path.startswith('/auth/o2/token'):
+			self.send_json(self.server.fixtures.token)
+		elif self.path.startswith('/batches/products/pricing/v0/itemOffers'):
+			self.send_json(self.server.fixtures.offers(json.loads(body)['requests']))
+		else:
+			self.send_body(b'', 'text/plain', 404)
+
+	def do_GET(self):
+		fixtures = self.server.fixtures
+		url = urlsplit(self.path)
+		query = parse_qs(url.query)
+
+		if url.path == '/reports/2021-06-30/reports':
+			self.send_json(fixtures.reports)
+		elif url.path.startswith('/reports/2021-06-30/documents/'):
+			document = fixtures.report_document.replace('{base_url}', self.server.base_url)
+			self.send_body(document.encode('utf-8'), 'application/json')
+		elif url.path == '/reports/documents/merchant_listings.txt.gz':
+			self.send_body(fixtures.report, 'application/octet-stream')
+		elif url.path == '/catalog/2022-04-01/items':
+			self.send_json(fixtures.catalog(query['identifiers'][0].split(',')))
+		elif url.path == '/products/pricing/v0/competitivePrice':
+			self.send_json(fixtures.pricing(query['Asins'][0].split(',')))
+		elif url.path == '/s':
+			category = query['rh'][0].split(':')[-1]
+			page_number = int(query['page'][0]) if 'page' in query else 1
+			self.send_body(fixtures.browse(category, page_number), 'text/html; charset=utf-8')
+		elif url.path.startswith('/search/keyword/'):
+			jan = url.path.rsplit('/', 1)[-1]
+			etag = f'"{jan}"'
+			if self.headers.get('If-None-Match') == etag:
+				self.send_body(b'', 'text/html', 304)
+			else:
+				self.send_body(fixtures.bookoff(jan), 'text/html; charset=utf-8', headers = {'ETag': etag})
+		else:
+			self.send_body(b'', 'text/plain', 404)
+
+# local server standing in for SP-API, LWA, Amazon and BookOff
+class StubServer:
+	def __init__(self, host = '127.0.0.1', port = 0, latency = 0.0, fixtures = None):
+		self.server = ThreadingHTTPServer((host, port), StubHandler)
+		self.server.daemon_threads = True
+		self.server.latency = latency
+		self.server.fixtures = fixtures or Fixtures()
+		self.server.base_url = f'http://{host}:{self.server.server_address[1]}'
+		self.thread = None
+
+	@property
+	def base_url(self):
+		return self.server.base_url
+
+	def start(self):
+		self.thread = threading.Thread(target = self.server.serve_forever, name = 'stub-server', daemon = True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+def serve(latency, port, conn):
+	server = StubServer(port = port, latency = latency)
+	conn.send(server.base_url)
+	conn.close()
+	server.server.serve_forever()
+
+# run the stub in its own process, so it does not compete with the benchmark for the GIL
+def start_process(latency = 0.0, port = 0):
+	parent_conn, child_conn = multiprocessing.Pipe(duplex = False)
+	process = multiprocessing.Process(target = serve, args = (latency, port, child_conn), name = 'stub-server', daemon = True)
+	process.start()
+	return process, parent_conn.recv()
+
+# serve the fixtures for a manual run: python stub_server.py [--port 8000] [--latency 0.2]
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'local stand-in for SP-API, Amazon and BookOff')
+	parser.add_argument('--port', type = int, default = 8000)
+	parser.add_argument('--latency', type = float, default = 0.0)
+	args = parser.parse_args()
+	server = StubServer(port = args.port, latency = args.latency)
+	print(f"serving fixtures on {server.base_url}")
+	try:
+		server.server.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,105 @@
+import logging
+import sqlite3
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+logger = logging.getLogger('table_model')
+
+COLUMNS = ['jan', 'url', 'stock', 'site_price', 'amazon_price', 'price_status']
+HEADER_LABELS = ["JAN", "URL", "在庫", "サイト価格", "Amazonの価格", "価格差"]
+
+# append-only product table, only touched from the GUI thread
+class ProductTableModel(QAbstractTableModel):
+	def __init__(self, parent = None):
+		super().__init__(parent)
+		self.rows = []
+
+	def rowCount(self, parent = QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self.rows)
+
+	def columnCount(self, parent = QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(COLUMNS)
+
+	def data(self, index, role = Qt.DisplayRole):
+		if not index.isValid() or role != Qt.DisplayRole:
+			return None
+		return self.rows[index.row()][index.column()]
+
+	def headerData(self, section, orientation, role = Qt.DisplayRole):
+		if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+			return HEADER_LABELS[section]
+		return super().headerData(section, orientation, role)
+
+	# append a batch of product dicts with a single row insertion
+	def append_rows(self, products):
+		if len(products) == 0:
+			return
+		first = len(self.rows)
+		self.beginInsertRows(QModelIndex(), first, first + len(products) - 1)
+		for product in products:
+			self.rows.append(tuple(str(product.get(key, "")) for key in COLUMNS))
+		self.endInsertRows()
+
+	def clear(self):
+		self.beginResetModel()
+		self.rows = []
+		self.endResetModel()
+
+	def url_at(self, row):
+		return self.rows[row][COLUMNS.index('url')]
+
+# rows of one run in the history, read from database.db a page at a time as the view scrolls down
+class HistoryTableModel(ProductTableModel):
+	def __init__(self, db_path = 'database.db', page_size = 500, parent = None):
+		super().__init__(parent)
+		self.conn = sqlite3.connect(db_path)
+		self.page_size = page_size
+		self.run_id = None
+		self.only_matched = False
+		self.last_row_id = 0
+		self.exhausted = True
+
+	# show run_id from its first page on
+	def load(self, run_id, only_matched = False):
+		self.beginResetModel()
+		self.rows = []
+		self.run_id = run_id
+		self.only_matched = only_matched
+		self.last_row_id = 0
+		self.exhausted = run_id is None
+		self.endResetModel()
+		self.fetchMore()
+
+	def canFetchMore(self, parent = QModelIndex()):
+		return not parent.isValid() and not self.exhausted
+
+	# next page after the last row shown, walking the run_id (and price_status) index in row_id order
+	def fetchMore(self, parent = QModelIndex()):
+		if not self.canFetchMore(parent):
+			return
+		status = " AND price_status = 'T'" if self.only_matched else ""
+		try:
+			rows = self.conn.execute(
+				f"SELECT row_id, {', '.join(COLUMNS)} FROM history WHERE run_id = ?{status} AND row_id > ? ORDER BY row_id LIMIT ?",
+				(self.run_id, self.last_row_id, self.page_size)
+			).fetchall()
+		except sqlite3.Error as e:
+			logger.error('SQLite error: %s', e)
+			rows = []
+		if len(rows) < self.page_size:
+			self.exhausted = True
+		if len(rows) == 0:
+			return
+		first = len(self.rows)
+		self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+		for row in rows:
+			self.rows.append(tuple('' if value is None else str(value) for value in row[1:]))
+		self.endInsertRows()
+		self.last_row_id = rows[-1][0]
+
+	def close(self):
+		self.conn.close()
@@ -0,0 +1,47 @@
+import batcher
+
+from batcher import AsinBatcher
+
+def test_full_batches_leave_as_soon_as_they_fill():
+	asin_batcher = AsinBatcher(size = 3)
+	assert asin_batcher.add(['a', 'b']) == []
+	assert asin_batcher.add(['c', 'd', 'e', 'f', 'g']) == [['a', 'b', 'c'], ['d', 'e', 'f']]
+	assert asin_batcher.pending == ['g']
+	assert len(asin_batcher) == 1
+
+def test_flush_returns_the_partial_batch_once():
+	asin_batcher = AsinBatcher(size = 3)
+	asin_batcher.add(['a', 'b'])
+	assert asin_batcher.flush() == [['a', 'b']]
+	assert asin_batcher.flush() == []
+	assert asin_batcher.oldest is None
+
+def test_partial_batch_leaves_after_max_wait(monkeypatch):
+	now = [100.0]
+	monkeypatch.setattr(batcher.time, 'monotonic', lambda: now[0])
+	asin_batcher = AsinBatcher(size = 3, max_wait = 10)
+	assert asin_batcher.add(['a']) == []
+	now[0] += 5
+	assert asin_batcher.add(['b']) == []
+	now[0] += 5
+	assert asin_batcher.add([]) == [['a', 'b']]
+	assert asin_batcher.pending == []
+
+def test_leftover_of_a_full_batch_starts_a_new_wait(monkeypatch):
+	now = [100.0]
+	monkeypatch.setattr(batcher.time, 'monotonic', lambda: now[0])
+	asin_batcher = AsinBatcher(size = 2, max_wait = 10)
+	asin_batcher.add(['a'])
+	now[0] += 9
+	assert asin_batcher.add(['b', 'c']) == [['a', 'b']]
+	now[0] += 9
+	assert asin_batcher.add([]) == []
+	now[0] += 1
+	assert asin_batcher.add([]) == [['c']]
+
+def test_reset_restores_pending_asins():
+	asin_batcher = AsinBatcher(size = 2)
+	asin_batcher.reset(['x'])
+	assert asin_batcher.add(['y']) == [['x', 'y']]
+	asin_batcher.reset()
+	assert asin_batcher.pending == [] and asin_batcher.oldest is None
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest
+
+from bookoff_parser import BASE_URL, parse_bookoff_page, parse_bookoff_page_soup
+
+FIXTURES = Path(__file__).resolve().parent.parent / 'fixtures' / 'bookoff'
+
+def item(href, price, alert = False):
+	stock = '<p class="productItem__stock productItem__stock--alert">在庫なし</p>' if alert else '<p class="productItem__stock">在庫あり</p>'
+	return (
+		f'<li class="productItem"><a class="productItem__link js-productLink" href="{href}">title</a>'
+		f'<p class="productItem__price">{price:,}<span class="productItem__tax">円(税込)</span></p>{stock}</li>'
+	)
+
+def page(*parts):
+	return ('<html><head><title>BOOKOFF</title></head><body><ul class="productList">'
+			+ ''.join(parts) + '</ul></body></html>').encode('utf-8')
+
+EDGE_CASES = {
+	'comment before the first result': (
+		page('<!-- <li class="productItem"><a class="productItem__link" href="/c">old</a>'
+			'<p class="productItem__price">1</p></li> -->', item('/y', 1280)),
+		{'url': BASE_URL + '/y', 'price': 1280, 'stock': ''},
+	),
+	'template string in a script': (
+		page('<script>const row = `<a class="productItem__link" href="/s">` + \'<p class="productItem__price">9</p>\';</script>',
+			item('/y', 2310, alert = True)),
+		{'url': BASE_URL + '/y', 'price': 2310, 'stock': '在庫なし'},
+	),
+	'upper case script and a style': (
+		page('<SCRIPT type="text/template"><li class="productItem"><a class="productItem__link" href="/t"></a></li></SCRIPT>'
+			'<style>.productItem__price { color: red }</style>', item('/y', 550)),
+		{'url': BASE_URL + '/y', 'price': 550, 'stock': ''},
+	),
+	'stock alert of a later result only': (
+		page(item('/first', 880), item('/second', 440, alert = True)),
+		{'url': BASE_URL + '/first', 'price': 880, 'stock': ''},
+	),
+	'price hidden in a comment inside the first result': (
+		page('<li class="productItem"><a class="productItem__link" href="/a">a</a>'
+			'<!-- <p class="productItem__price">1</p> --><p class="productItem__price">3,300</p></li>', item('/b', 10)),
+		{'url': BASE_URL + '/a', 'price': 3300, 'stock': ''},
+	),
+	'no results': (
+		page('<!-- <a class="productItem__link" href="/c"> --><p class="searchResult__none">該当する商品がありません</p>'),
+		None,
+	),
+}
+
+@pytest.mark.parametrize('filepath', sorted(FIXTURES.glob('*.html')), ids = lambda filepath: filepath.name)
+def test_fixture_pages_match_reference(filepath):
+	content = filepath.read_bytes()
+	assert parse_bookoff_page(content) == parse_bookoff_page_soup(content)
+
+@pytest.mark.parametrize('name', EDGE_CASES)
+def test_edge_cases(name):
+	content, expected = EDGE_CASES[name]
+	assert parse_bookoff_page(content) == expected
+	assert parse_bookoff_page_soup(content) == expected
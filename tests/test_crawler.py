@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from crawler import Crawler
+
+# just enough of ActionManagement for Crawler.run
+class FakeHandler:
+	metrics_interval = 10
+	metrics_file = ''
+	last_row = 0
+
+	def __init__(self, download):
+		self.download = download
+		self.statuses = []
+		self.seen = SimpleNamespace(skipped = 0)
+		self.metrics = SimpleNamespace(slowest = lambda: None)
+
+	def load_checkpoint(self):
+		return None
+
+	def start_run(self, checkpoint, mode):
+		pass
+
+	def product_list_download_from_amazon(self, report_document_id = ''):
+		return self.download()
+
+	def finish_run(self, status = None):
+		self.statuses.append(status)
+
+def run(handler):
+	statuses = []
+	errors = []
+	crawler = Crawler(handler, 'report', on_status = statuses.append, on_error = errors.append)
+	return crawler.run(), statuses, errors
+
+def test_report_error_fails_the_run():
+	handler = FakeHandler(lambda: 'レポートを取得できません。')
+	assert run(handler) == (False, ['start', 'stop'], ['レポートを取得できません。'])
+	assert handler.statuses == ['failed']
+
+def test_unexpected_error_still_ends_the_run():
+	def download():
+		raise IndexError('list index out of range')
+	handler = FakeHandler(download)
+	assert run(handler) == (False, ['start', 'stop'], ['list index out of range'])
+	assert handler.statuses == ['failed']
+
+class RankingHandler(FakeHandler):
+	def __init__(self, cur_category, cur_page):
+		super().__init__(None)
+		self.cur_category = cur_category
+		self.cur_page = cur_page
+
+	def get_category(self, position):
+		return 'music' if position >= 100 else 'dvd'
+
+def resumed_pages(cur_category, cur_page, position):
+	crawler = Crawler(RankingHandler(cur_category, cur_page))
+	crawler.position = position
+	pages = crawler.iter_ranking_pages()
+	return [next(pages), next(pages)]
+
+def test_resume_goes_on_from_the_checkpointed_category():
+	assert resumed_pages('music', 3, 150) == [('music', 4), ('music', 5)]
+
+def test_resume_after_pages_of_the_old_category_starts_the_new_one_from_its_first_page():
+	# the checkpoint was written for a dvd page still in flight when the position crossed into music
+	assert resumed_pages('dvd', 9, 150) == [('music', 1), ('music', 2)]
+
+def test_fresh_crawl_takes_the_category_of_the_position():
+	assert resumed_pages('', 0, 0) == [('dvd', 1), ('dvd', 2)]
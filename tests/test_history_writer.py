@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+import history_writer
+
+from history_writer import HistoryWriter, prepare_history, start_new_run
+
+def connect(tmp_path):
+	conn = sqlite3.connect(tmp_path / 'database.db')
+	prepare_history(conn)
+	return conn
+
+def run_ids(conn):
+	return [row[0] for row in conn.execute("SELECT run_id FROM runs ORDER BY started_at")]
+
+def test_runs_are_kept_unless_pruning_is_asked_for(tmp_path):
+	conn = connect(tmp_path)
+	for n in range(12):
+		start_new_run(conn, f'run{n}')
+	assert len(run_ids(conn)) == 12
+
+def test_pruning_keeps_the_newest_runs_and_the_imported_history(tmp_path):
+	conn = connect(tmp_path)
+	conn.execute("INSERT INTO runs (run_id, status, started_at) VALUES ('legacy', 'imported', 0)")
+	conn.execute("INSERT INTO history (run_id, jan) VALUES ('legacy', '4901234567894')")
+	for n in range(4):
+		start_new_run(conn, f'run{n}')
+		conn.execute("INSERT INTO history (run_id, jan) VALUES (?, '4901234567895')", (f'run{n}',))
+	start_new_run(conn, 'run4', keep_runs = 2)
+	assert sorted(run_ids(conn)) == ['legacy', 'run3', 'run4']
+	assert sorted(row[0] for row in conn.execute("SELECT DISTINCT run_id FROM history")) == ['legacy', 'run3']
+
+def test_failed_commits_keep_the_rows_and_then_stop_the_crawl(tmp_path, monkeypatch):
+	writer = HistoryWriter(str(tmp_path / 'database.db'), flush_interval = 60, max_failures = 2)
+	writer.prepare()
+	writer.start('run', reset = True)
+	monkeypatch.setattr(history_writer, 'INSERT_HISTORY', 'INSERT INTO missing VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+	writer.write((1, '4901234567894', 'url', '', 100, 200, 'T'))
+	writer.write_checkpoint({'position': 1})
+	writer.flush()
+	writer.write((2, '4901234567895', 'url', '', 100, 200, 'F'))
+	writer.flush()
+	with pytest.raises(sqlite3.OperationalError):
+		writer.write((3, '4901234567896', 'url', '', 100, 200, 'F'))
+
+	monkeypatch.undo()
+	writer.stop('stopped')
+	conn = sqlite3.connect(tmp_path / 'database.db')
+	assert [row[0] for row in conn.execute("SELECT id FROM history ORDER BY id")] == [1, 2]
+	assert writer.load_checkpoint() == {'position': 1}
@@ -0,0 +1,99 @@
+import random
+import threading
+import time
+
+from pipeline import Marker, Pipeline, Stage, StageError
+
+class End(Marker):
+	def __init__(self, number):
+		self.number = number
+
+def jitter(value):
+	time.sleep(random.uniform(0, 0.003))
+	return value
+
+def test_results_keep_input_order_across_workers():
+	stages = [
+		Stage('double', lambda n: [jitter(n * 2)], workers = 4),
+		Stage('add', lambda n: [jitter(n + 1)], workers = 3, queue_size = 1),
+	]
+	assert list(Pipeline(iter(range(200)), stages).results()) == [n * 2 + 1 for n in range(200)]
+
+def test_stage_may_emit_any_number_of_items():
+	stage = Stage('repeat', lambda n: [n] * n, workers = 3)
+	assert list(Pipeline(iter([0, 2, 1, 3]), [stage]).results()) == [2, 2, 1, 3, 3, 3]
+
+def test_markers_pass_through_untouched_and_in_order():
+	seen = []
+	def record(n):
+		seen.append(n)
+		return [jitter(n)]
+	source = [1, 2, End(1), 3, End(2)]
+	results = list(Pipeline(iter(source), [Stage('record', record, workers = 4)]).results())
+	assert results[:2] == [1, 2] and results[3] == 3
+	assert results[2] is source[2] and results[4] is source[4]
+	assert sorted(seen) == [1, 2, 3]
+
+def test_errors_become_markers_in_place():
+	def check(n):
+		if n == 2:
+			raise ValueError('two')
+		return [n]
+	stages = [Stage('check', check, workers = 2), Stage('pass', lambda n: [n])]
+	results = list(Pipeline(iter([1, 2, 3]), stages).results())
+	assert results[0] == 1 and results[2] == 3
+	assert isinstance(results[1], StageError) and str(results[1].error) == 'two'
+
+def test_source_error_ends_the_stream():
+	def source():
+		yield 1
+		raise RuntimeError('source broke')
+	results = list(Pipeline(source(), [Stage('pass', lambda n: [n], workers = 2)]).results())
+	assert results[0] == 1
+	assert isinstance(results[1], StageError) and str(results[1].error) == 'source broke'
+	assert len(results) == 2
+
+def test_finish_runs_after_the_last_item():
+	collected = []
+	def collect(n):
+		collected.append(n)
+		return []
+	def finish():
+		return [sum(collected)]
+	stages = [Stage('collect', collect, finish = finish), Stage('pass', lambda n: [n], workers = 2)]
+	assert list(Pipeline(iter([1, 2, 3, 4]), stages).results()) == [10]
+
+def test_finish_error_is_handed_on():
+	def finish():
+		raise KeyError('flush')
+	results = list(Pipeline(iter([1]), [Stage('pass', lambda n: [n], finish = finish)]).results())
+	assert results[0] == 1 and isinstance(results[1], StageError)
+
+def test_stopping_the_source_drains_items_in_flight():
+	stop = threading.Event()
+	def source():
+		for n in range(1000):
+			if stop.is_set():
+				return
+			yield n
+	results = []
+	for item in Pipeline(source(), [Stage('slow', lambda n: [jitter(n)], workers = 4)]).results():
+		results.append(item)
+		if item == 10:
+			stop.set()
+	# everything that was fed still comes out, in order
+	assert results == list(range(len(results)))
+	assert 10 < len(results) < 1000
+
+def test_closing_the_results_aborts_blocked_workers():
+	release = threading.Event()
+	def slow(n):
+		release.wait(0.2)
+		return [n]
+	pipeline = Pipeline(iter(range(100)), [Stage('slow', slow, workers = 2, queue_size = 1)], queue_size = 1)
+	results = pipeline.results()
+	assert next(results) == 0
+	started = time.monotonic()
+	results.close()
+	assert time.monotonic() - started < 2
+	assert not any(thread.is_alive() for thread in pipeline.threads)
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from rate_limiter import SpApiScheduler
+
+# answers with the queued status codes and records the token of every request
+class FakeHttp:
+	def __init__(self, *status_codes):
+		self.status_codes = list(status_codes)
+		self.tokens = []
+
+	def request(self, method, url, headers = None, **kwargs):
+		self.tokens.append(headers['x-amz-access-token'])
+		return SimpleNamespace(status_code = self.status_codes.pop(0), headers = {}, request = SimpleNamespace(headers = headers))
+
+def scheduler(http, tokens, rejected):
+	return SpApiScheduler(http, limits = {'op': (1000, 1000)}, on_rejected = rejected.append, access_token = lambda: tokens.pop(0))
+
+def test_rejected_token_is_renewed_and_the_request_sent_again():
+	http = FakeHttp(403, 200)
+	rejected = []
+	response = scheduler(http, ['new'], rejected).get('op', 'url', headers = {'x-amz-access-token': 'old'})
+	assert response.status_code == 200
+	assert http.tokens == ['old', 'new']
+	assert [r.request.headers['x-amz-access-token'] for r in rejected] == ['old']
+
+def test_request_is_sent_again_only_once():
+	http = FakeHttp(401, 401)
+	rejected = []
+	response = scheduler(http, ['new', 'newer'], rejected).get('op', 'url', headers = {'x-amz-access-token': 'old'})
+	assert response.status_code == 401
+	assert http.tokens == ['old', 'new']
+	assert len(rejected) == 2
+
+def test_rejection_is_returned_when_no_new_token_comes():
+	http = FakeHttp(403)
+	response = scheduler(http, [''], []).get('op', 'url', headers = {'x-amz-access-token': 'old'})
+	assert response.status_code == 403
+	assert http.tokens == ['old']
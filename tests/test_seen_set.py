@@ -0,0 +1,44 @@
+from seen_set import BloomFilter, SeenSet
+
+def test_bloom_filter_has_no_false_negatives():
+	bloom = BloomFilter(capacity = 10000, error_rate = 1e-4)
+	keys = [f'asin:B0{n:08d}' for n in range(10000)]
+	for key in keys:
+		bloom.add(key)
+	assert all(key in bloom for key in keys)
+	false_positives = sum(f'jan:{n}' in bloom for n in range(10000))
+	assert false_positives < 10
+
+def test_first_seen_drops_repeats_within_and_across_calls():
+	seen = SeenSet(capacity = 1000)
+	assert seen.first_seen('asin', ['a', 'b', 'a']) == ['a', 'b']
+	assert seen.first_seen('asin', ['b', 'c']) == ['c']
+	assert seen.skipped == 2
+
+def test_kinds_do_not_collide():
+	seen = SeenSet(capacity = 1000)
+	assert seen.first_seen('asin', ['4901234567894']) == ['4901234567894']
+	assert seen.first_seen('jan', ['4901234567894']) == ['4901234567894']
+
+def test_tagged_keys_count_as_seen_before_they_are_committed():
+	seen = SeenSet(capacity = 1000)
+	assert seen.first_seen('asin', ['a', 'b'], tag = 1) == ['a', 'b']
+	assert seen.first_seen('asin', ['c'], tag = 2) == ['c']
+	assert seen.first_seen('asin', ['a', 'c'], tag = 3) == []
+	assert sorted(seen.commit(1)) == [('asin', 'a'), ('asin', 'b')]
+	assert seen.commit(1) == []
+	assert seen.commit(3) == [('asin', 'c')]
+	assert seen.first_seen('asin', ['a', 'c']) == []
+
+def test_reset_loads_the_checkpointed_keys_only():
+	seen = SeenSet(capacity = 1000)
+	seen.first_seen('asin', ['a', 'b'])
+	seen.reset([('asin', 'a'), ('jan', '4901234567894')])
+	assert seen.skipped == 0
+	assert seen.first_seen('asin', ['a', 'b']) == ['b']
+	assert seen.first_seen('jan', ['4901234567894']) == []
+
+def test_disabled_set_lets_everything_through():
+	seen = SeenSet(capacity = 1000, enabled = False)
+	assert seen.first_seen('asin', ['a', 'a']) == ['a', 'a']
+	assert seen.commit(1) == []
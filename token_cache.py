@@ -0,0 +1,72 @@
+import threading
+import time
+
+# LWA access token cache, refreshed ahead of expiry in the background
+class AccessTokenCache:
+	def __init__(self, fetch, refresh_margin = 300, retry_interval = 30):
+		self.fetch = fetch  # returns (access_token, expires_in); ('', 0) on failure
+		self.refresh_margin = refresh_margin
+		self.retry_interval = retry_interval
+		self.lock = threading.Lock()
+		self.refresh_lock = threading.Lock()
+		self.token = ''
+		self.expires_at = 0
+		self.retry_at = 0
+		self.refreshing = False
+
+	# return a valid token, only blocking when none is cached; '' while a failed fetch backs off
+	def get(self):
+		now = time.monotonic()
+		with self.lock:
+			token = self.token
+			expires_at = self.expires_at
+
+		if token and now < expires_at:
+			if now >= expires_at - self.refresh_margin:
+				self.refresh_in_background()
+			return token
+		return self.refresh(0)
+
+	# refresh unless the cached token is still valid for min_validity seconds
+	# or the last fetch failed less than retry_interval seconds ago
+	def refresh(self, min_validity):
+		with self.refresh_lock:
+			now = time.monotonic()
+			with self.lock:
+				if self.token and now < self.expires_at - min_validity:
+					return self.token
+				if now < self.retry_at:
+					return self.token if now < self.expires_at else ''
+
+			token, expires_in = self.fetch()
+			with self.lock:
+				if token:
+					self.token = token
+					self.expires_at = time.monotonic() + expires_in
+				else:
+					self.retry_at = time.monotonic() + self.retry_interval
+				return self.token if time.monotonic() < self.expires_at else ''
+
+	def refresh_in_background(self):
+		with self.lock:
+			if self.refreshing or time.monotonic() < self.retry_at:
+				return
+			self.refreshing = True
+		threading.Thread(target = self._background_refresh, daemon = True).start()
+
+	def _background_refresh(self):
+		try:
+			self.refresh(self.refresh_margin)
+		finally:
+			with self.lock:
+				self.refreshing = False
+
+	# drop the cached token after the API rejected it; token: the rejected one,
+	# so requests still carrying an older token do not drop a fresh one
+	def invalidate(self, token = None):
+		with self.lock:
+			if token is not None and token != self.token:
+				return
+			self.token = ''
+			self.expires_at = 0
+			self.retry_at = 0